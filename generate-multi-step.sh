@@ -1,14 +1,12 @@
 #!/bin/bash
 
-for i in `seq 1 10`
+for j in StationShortestCount StationShortestAvoidingCount StationTwoHops NearestStationArchitecture DistinctRoutes CountCycles
 do
-	for j in StationShortestCount StationShortestAvoidingCount StationTwoHops NearestStationArchitecture DistinctRoutes CountCycles
-	do
-		nohup python -m gqa.generate \
-			--count 100 \
-			--small \
-			--type-prefix $j \
-			--name $j-$i &
+	python -m gqa.generate \
+		--count 1000 \
+		--small \
+		--type-prefix $j \
+		--workers 10 \
+		--name $j
 
-	done
-done
\ No newline at end of file
+done
@@ -1,13 +1,10 @@
 #!/bin/bash
 
-tenth=100
 j=StationAdjacent
 
-for i in `seq 1 10`
-do
-	nohup python -m gqa.generate \
-		--count $tenth \
-		--small \
-		--type-prefix $j \
-		--name $j-$i &
-done
\ No newline at end of file
+python -m gqa.generate \
+	--count 1000 \
+	--small \
+	--type-prefix $j \
+	--workers 10 \
+	--name $j
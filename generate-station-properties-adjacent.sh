@@ -1,3 +1,3 @@
 #!/bin/sh
 
-python -m gqa.generate --count 100000 --small --type-prefix StationProperty --type-prefix StationAdjacent
\ No newline at end of file
+python -m gqa.generate --count 100000 --small --type-prefix StationProperty --type-prefix StationAdjacent --name sp-sa-small-100m
\ No newline at end of file
@@ -1,10 +1,13 @@
 
 import argparse
 
-def get_args():
+def get_args(argv=None):
 	parser = argparse.ArgumentParser()
 	parser.add_argument('--group', type=str, default=None)
 	parser.add_argument('--type-prefix', action="append", help="Only generate questions of type prefix")
+	parser.add_argument('--quota', action="append", help="TypeString=N: generate exactly N questions of this type (repeatable, overrides --count, --group and --type-prefix)")
+	parser.add_argument('--form-retries', type=int, default=10, help="Most attempts at a question form on one graph before moving on")
+	parser.add_argument('--cost-aware-retries', action='store_true', help="Retry cheap question forms on the same graph for longer, judged by measured form and graph times (faster, but seeded runs no longer reproduce exactly)")
 
 	parser.add_argument('--name', type=str, default=None)
 
@@ -13,12 +16,35 @@ def get_args():
 
 	parser.add_argument('--log-level', type=str, default='INFO')
 	parser.add_argument('--questions-per-graph', type=int, default=1, help="Number of (Q,A) per G")
+	parser.add_argument('--format', type=str, default='yaml', choices=['yaml', 'jsonl', 'msgpack', 'parquet'], help="Output file format")
+	parser.add_argument('--compact-graphs', action='store_true', help="Hold graphs as compact arrays, only building node/edge objects and networkx graphs when a question needs them (same output)")
 	parser.add_argument('--omit-graph', action='store_true', help="Don't export the graph")
+	parser.add_argument('--graph-store', type=str, nargs='?', const='jsonl', default=None, choices=['jsonl', 'binary'], help="Write each graph once to a separate graph store and reference it by id from each question. A binary store holds every graph's arrays for memory mapping (see gqa.binary_store)")
+	parser.add_argument('--index', action='store_true', help="Also write the byte offset and length of each document to {dataset}.offsets, for random access (see gqa.index)")
 	parser.add_argument('--string-names', action='store_false', dest="int_names", help="Use integers as names")
+	parser.add_argument('--name-pool', type=str, default=None, help="Load the station and line name pools from this file, building and saving them there if it doesn't exist")
 	parser.add_argument('--enable-cypher', action='store_true', dest='generate_cypher')
-	parser.add_argument('--draw', action='store_true', help="Write image of graphs")
+	parser.add_argument('--draw', action='store_true', help="Write an image of each graph to ./data, named by its graph id")
+	parser.add_argument('--draw-format', type=str, default='png', choices=['png', 'svg'], help="Image format for --draw")
+	parser.add_argument('--draw-size', type=float, default=30, help="Width and height of --draw images in inches")
+	parser.add_argument('--draw-dpi', type=int, default=100, help="Resolution of --draw PNG images")
+	parser.add_argument('--draw-workers', type=int, default=1, help="Background processes drawing graphs for --draw, 0 to draw inline")
 
 	parser.add_argument('--tiny',  action='store_true', help="Generate really small graphs (faster)")
 	parser.add_argument('--small', action='store_true', help="Generate small graphs (faster)")
+	parser.add_argument('--lines', type=int, default=None, help="Number of lines per graph, for large graphs (scale mode)")
+	parser.add_argument('--stations-per-line', type=int, default=None, help="Number of stations per line, for large graphs (scale mode)")
+	parser.add_argument('--graph-batch', type=int, default=1, help="Generate graphs this many at a time, which is much faster for --tiny and --small graphs")
+	parser.add_argument('--topologies', type=int, default=0, help="Build this many graph topologies per output file, then make every graph by resampling properties, names and ids on one of them (much faster)")
+	parser.add_argument('--map-radius', type=float, default=None, help="Half the width of the map. In scale mode it defaults to keeping the default station density")
+
+	parser.add_argument('--workers', type=int, default=None, help="Split generation across this many processes, writing one shard each plus a manifest")
+	parser.add_argument('--checkpoint-every', type=int, default=1000, help="Checkpoint progress every this many (G,Q,A), 0 to disable")
+	parser.add_argument('--resume', action='store_true', help="Continue an interrupted run (same --name and options) from its last checkpoint")
+	parser.add_argument('--report', action='store_true', help="Time each phase of generation and write a JSON run report next to the output")
+	parser.add_argument('--profile', type=str, default=None, choices=['cprofile', 'sample'], help="Profile each worker with cProfile (.prof pstats) or by stack sampling (.collapsed stacks), written alongside the output and merged for sharded runs")
+	parser.add_argument('--profile-phase', action='append', choices=['graph', 'form', 'serialize'], help="Only profile this phase (repeatable), rather than the whole run")
+	parser.add_argument('--profile-interval', type=float, default=0.005, help="Seconds between stack samples for --profile sample")
+	parser.add_argument('--seed', type=int, default=None, help="Master random seed. Sharded (--workers) runs with the same seed reproduce their output exactly")
 	
-	return parser.parse_args()
\ No newline at end of file
+	return parser.parse_args(argv)
\ No newline at end of file
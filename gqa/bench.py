@@ -0,0 +1,320 @@
+
+import io
+import math
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import statistics
+import multiprocessing
+
+from .generate_graph import GraphGenerator
+from .questions import question_forms
+from .context import GraphContext
+from .writer import writers
+from .types import DocumentSpec
+from .args import get_args
+from .telemetry import telemetry
+
+import logging
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------
+# Benchmarks for graph generation, question forms and serialization
+#
+# python -m gqa.bench --output new.json [--compare baseline.json]
+#
+# Everything runs on seeded graphs, so two runs do the same work and only the
+# timings differ. Results are seconds per call, and the median is compared
+# --------------------------------------------------------------------------
+
+SIZES = {
+	"tiny": ["--tiny"],
+	"small": ["--small"],
+	"default": [],
+}
+
+
+def summarise(times):
+	return {
+		"n": len(times),
+		"min": min(times),
+		"median": statistics.median(times),
+		"mean": statistics.mean(times),
+	}
+
+
+def measure(fn, n):
+	"""Time fn(k) for k in range(n), after one untimed call of fn(0) to warm caches and imports"""
+	fn(0)
+	times = []
+	for k in range(n):
+		start = time.perf_counter()
+		fn(k)
+		times.append(time.perf_counter() - start)
+	return summarise(times)
+
+
+def per_graph(summary, batch):
+	"""A summary of batch timings per graph, to compare with graph.generate"""
+	return {k: v if k == "n" else v / batch for k, v in summary.items()}
+
+
+def seeded_graph(gen_args, seed):
+	random.seed(seed)
+	return GraphGenerator(gen_args).generate().graph_spec
+
+
+def seeded_topology(gen_args, seed):
+	random.seed(seed)
+	g = GraphGenerator(gen_args)
+	g.gen_lines()
+	g.gen_stations()
+	return g.topology()
+
+
+def bench_graphs(opts, results):
+	for size, flags in SIZES.items():
+		gen_args = get_args(flags)
+		def generate(k):
+			random.seed(opts.seed + k)
+			GraphGenerator(gen_args).generate()
+		results[f"graph.generate.{size}"] = measure(generate, opts.repeat)
+
+		topology = seeded_topology(gen_args, opts.seed)
+		def resample(k):
+			random.seed(opts.seed + k)
+			GraphGenerator(gen_args).generate(topology=topology)
+		results[f"graph.resample.{size}"] = measure(resample, opts.repeat)
+
+		def generate_batch(k):
+			random.seed(opts.seed + k)
+			GraphGenerator(gen_args).generate_batch(opts.batch)
+		results[f"graph.generate_batch.{size}"] = per_graph(measure(generate_batch, opts.repeat), opts.batch)
+
+		def resample_batch(k):
+			random.seed(opts.seed + k)
+			GraphGenerator(gen_args).generate_batch(opts.batch, topologies=[topology] * opts.batch)
+		results[f"graph.resample_batch.{size}"] = per_graph(measure(resample_batch, opts.repeat), opts.batch)
+
+	g = seeded_graph(get_args([]), opts.seed)
+	results["graph.gen_gnx.default"] = measure(lambda k: g.gen_gnx(), opts.repeat)
+
+	compact_args = get_args(["--compact-graphs"])
+	def generate_compact(k):
+		random.seed(opts.seed + k)
+		GraphGenerator(compact_args).generate()
+	results["graph.generate_compact.default"] = measure(generate_compact, opts.repeat)
+
+
+def bench_forms(opts, results):
+	"""Time every question form on the same seeded graphs, returning the documents made"""
+
+	gen_args = get_args(SIZES[opts.form_size] + (["--compact-graphs"] if opts.compact_graphs else []))
+	graphs = [seeded_graph(gen_args, opts.seed + k) for k in range(opts.graphs)]
+	attempts = [(g, r) for g in graphs for r in range(opts.repeat)]
+	docs = []
+
+	for form in question_forms:
+		if opts.filter is not None and not form.type_string.startswith(opts.filter):
+			continue
+
+		# By attempt, so the warm-up call of attempt 0 isn't counted twice
+		accepted = {}
+
+		def attempt(k):
+			g, r = attempts[k]
+			random.seed(opts.seed + k)
+			try:
+				q, a = form.generate(GraphContext(g), gen_args)
+				accepted[k] = DocumentSpec(g, q, a) if r == 0 else None
+			except ValueError:
+				pass
+
+		def strip(k):
+			g, r = attempts[k]
+			random.seed(opts.seed + k)
+			try:
+				args = form.sample_arguments(GraphContext(g))
+			except ValueError:
+				return
+			form.stripped_functional(args)
+
+		results[f"form.{form.type_string}"] = {
+			**measure(attempt, len(attempts)),
+			"acceptance": len(accepted) / len(attempts),
+		}
+		docs.extend(d for k, d in sorted(accepted.items()) if d is not None)
+		results[f"stripped.{form.type_string}"] = measure(strip, len(attempts))
+
+	return docs
+
+
+def bench_serialization(opts, docs, results):
+	if len(docs) == 0:
+		return
+
+	results["stripped.document"] = measure(lambda k: docs[k].stripped(), len(docs))
+
+	for extension, Writer in writers.items():
+		def write(k):
+			file = io.BytesIO() if "b" in Writer.mode else io.StringIO()
+			with Writer(file) as writer:
+				writer.write_all(docs)
+		try:
+			results[f"serialize.{extension}"] = measure(write, opts.repeat)
+		except ImportError as ex:
+			logger.warning(f"Skipping {extension}: {ex}")
+
+
+def scale_flags(stations):
+	"""Scale mode arguments for about this many stations, on a square number of lines"""
+	lines = max(1, round(math.sqrt(stations)))
+	return ["--lines", str(lines), "--stations-per-line", str(max(2, stations // lines))]
+
+
+def peak_rss_mb():
+	"""
+	This process's peak RSS. On Linux this is VmHWM, as ru_maxrss in a spawned process
+	still counts the parent's memory from the fork before its exec
+	"""
+	try:
+		with open("/proc/self/status", "r") as file:
+			for line in file:
+				if line.startswith("VmHWM:"):
+					return int(line.split()[1]) / 1024
+	except OSError:
+		pass
+
+	# ru_maxrss is in KiB on Linux
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def generate_at_scale(stations, seed):
+	"""Generate one graph in scale mode, returning its phase times and this process's peak RSS"""
+	telemetry.enabled = True
+	random.seed(seed)
+
+	start = time.perf_counter()
+	g = GraphGenerator(get_args(scale_flags(stations))).generate().graph_spec
+	seconds = time.perf_counter() - start
+
+	return {
+		"seconds": seconds,
+		"stations": len(g.nodes),
+		"edges": len(g.edges),
+		"phases": {phase: h.total for (phase, t), h in telemetry.timings.items()},
+		"peak_rss_mb": peak_rss_mb(),
+	}
+
+
+def bench_scale(opts, results):
+	# A fresh process for each graph, so each peak RSS is that graph's alone
+	ctx = multiprocessing.get_context("spawn")
+	for stations in opts.scale:
+		with ctx.Pool(1) as pool:
+			runs = [pool.apply(generate_at_scale, (stations, opts.seed + k)) for k in range(opts.scale_repeat)]
+
+		results[f"scale.{stations}"] = {
+			**summarise([r["seconds"] for r in runs]),
+			"stations": runs[0]["stations"],
+			"edges": runs[0]["edges"],
+			"phases": runs[0]["phases"],
+			"peak_rss_mb": max(r["peak_rss_mb"] for r in runs),
+		}
+
+
+def run(opts):
+	results = {}
+	bench_graphs(opts, results)
+	docs = bench_forms(opts, results)
+	bench_serialization(opts, docs, results)
+	bench_scale(opts, results)
+
+	return {
+		"meta": {
+			"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+			"python": platform.python_version(),
+			"machine": platform.machine(),
+			"seed": opts.seed,
+			"repeat": opts.repeat,
+			"graphs": opts.graphs,
+			"form_size": opts.form_size,
+			"compact_graphs": opts.compact_graphs,
+			"batch": opts.batch,
+		},
+		"results": results,
+	}
+
+
+def compare(baseline, current, threshold):
+	"""Print each benchmark against the baseline, returning the names that regressed by more than threshold"""
+
+	regressions = []
+	for name, r in current["results"].items():
+		if name not in baseline["results"]:
+			continue
+
+		base = baseline["results"][name]["median"]
+		ratio = r["median"] / base if base > 0 else 1.0
+
+		if ratio > 1 + threshold:
+			flag = "REGRESSION"
+			regressions.append(name)
+		elif ratio < 1 - threshold:
+			flag = "faster"
+		else:
+			flag = ""
+
+		print(f"{name:50} {1000*base:10.3f}ms {1000*r['median']:10.3f}ms {ratio:6.2f}x {flag}")
+
+	return regressions
+
+
+def get_bench_args(argv=None):
+	parser = argparse.ArgumentParser(description="Benchmark graph generation, question forms and serialization")
+	parser.add_argument('--output', type=str, default=None, help="Write results as JSON here")
+	parser.add_argument('--compare', type=str, default=None, help="Baseline results JSON to compare against")
+	parser.add_argument('--threshold', type=float, default=0.2, help="Slow down (as a fraction of the baseline) that counts as a regression")
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--repeat', type=int, default=5, help="Runs of each benchmark (per graph for question forms)")
+	parser.add_argument('--graphs', type=int, default=5, help="Number of seeded graphs to ask each question form on")
+	parser.add_argument('--form-size', type=str, default='small', choices=list(SIZES.keys()), help="Size of the graphs for question forms")
+	parser.add_argument('--compact-graphs', action='store_true', help="Ask the question forms of compact graphs")
+	parser.add_argument('--filter', type=str, default=None, help="Only benchmark question forms with this type prefix")
+	parser.add_argument('--batch', type=int, default=100, help="Graphs per GraphGenerator.generate_batch call (timed per graph)")
+	parser.add_argument('--scale', type=int, nargs='*', default=[], help="Also time generating one graph of each of these numbers of stations in scale mode, with its peak RSS (e.g. --scale 10000 100000 1000000)")
+	parser.add_argument('--scale-repeat', type=int, default=1, help="Graphs generated at each --scale size")
+	parser.add_argument('--log-level', type=str, default='WARNING')
+	return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+
+	opts = get_bench_args()
+
+	logging.basicConfig()
+	logging.getLogger('gqa').setLevel(opts.log_level)
+
+	current = run(opts)
+
+	if opts.output is not None:
+		with open(opts.output, "w") as file:
+			json.dump(current, file, indent=2)
+
+	if opts.compare is not None:
+		with open(opts.compare, "r") as file:
+			baseline = json.load(file)
+
+		regressions = compare(baseline, current, opts.threshold)
+		if len(regressions) > 0:
+			print(f"{len(regressions)} regressions over {opts.threshold:.0%}: {', '.join(regressions)}")
+			sys.exit(1)
+
+	else:
+		for name, r in current["results"].items():
+			rss = f" {r['peak_rss_mb']:10.1f}MB peak RSS" if "peak_rss_mb" in r else ""
+			print(f"{name:50} {1000*r['median']:10.3f}ms{rss}")
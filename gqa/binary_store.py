@@ -0,0 +1,314 @@
+
+import os
+import os.path
+import json
+import numpy as np
+
+from .types import GraphSpec
+from .compact import CompactGraphSpec, encode
+from .generate_graph import StationProperties, ScaleLineProperties
+
+# --------------------------------------------------------------------------
+# Binary graph store: every graph's arrays, concatenated and memory mapped
+#
+# The store is a directory {dataset}.graphs holding one flat little endian
+# array per file, as a CompactGraphSpec holds them:
+#   graph_id, node_start, edge_start, line_start     one per graph
+#   node_id, node_name, x, y, node.{property}        one per station
+#   line_id, line_name, line.{property}              one per line
+#   edge_src, edge_dst, edge_line                    one per edge
+#   strings, string_start                            the table of names
+# Ids are null padded to 36 bytes (a uuid, or an integer name). Properties
+# are codes into the categories in meta.json, names index the string table
+# and edges index the stations and lines of their own graph.
+#
+# Readers map the files read only, so processes reading the same store share
+# its pages in the OS page cache rather than each holding parsed graphs
+# --------------------------------------------------------------------------
+
+ID_WIDTH = 36
+
+# The arrays of each kind, the first of which gives how many there are
+ARRAYS = {
+	"graph": {
+		"graph_id": f"S{ID_WIDTH}",
+		"node_start": "<i8",
+		"edge_start": "<i8",
+		"line_start": "<i8",
+	},
+	"node": {
+		"node_id": f"S{ID_WIDTH}",
+		"node_name": "<i4",
+		"x": "<f8",
+		"y": "<f8",
+	},
+	"line": {
+		"line_id": f"S{ID_WIDTH}",
+		"line_name": "<i4",
+	},
+	"edge": {
+		"edge_src": "<i4",
+		"edge_dst": "<i4",
+		"edge_line": "<i4",
+	},
+	"string": {
+		"string_start": "<i8",
+	},
+	"byte": {
+		"strings": "u1",
+	},
+}
+
+CODE = "u1"
+
+def binary_store_filename(dataset_filename):
+	return os.path.splitext(dataset_filename)[0] + ".graphs"
+
+
+def array_kinds(meta):
+	"""The arrays of each kind in a store with this meta, and their dtypes"""
+	return {
+		**ARRAYS,
+		"node": {**ARRAYS["node"], **{f"node.{k}": CODE for k in meta["node_categories"]}},
+		"line": {**ARRAYS["line"], **{f"line.{k}": CODE for k in meta["line_categories"]}},
+	}
+
+def array_types(meta):
+	"""Every array of a store with this meta, and its dtype"""
+	return {name: dtype for arrays in array_kinds(meta).values() for name, dtype in arrays.items()}
+
+
+def recode(codes, categories, to):
+	"""codes into categories as codes into to"""
+	if categories == to:
+		return codes
+	return encode([categories[i] for i in codes], to)
+
+
+class BinaryGraphStoreWriter(object):
+	"""
+	Appends graphs to a binary graph store. Its offset is the length of every array,
+	which is all a checkpoint needs to cut the store back to with resume.
+	"""
+
+	def __init__(self, dirname, resume=None):
+		self.dirname = dirname
+		self.meta = None
+		self.files = {}
+		self.counts = {}
+		self.ids = set()
+		self.strings = {}
+
+		# A checkpoint from before the first graph has nothing to keep
+		if resume:
+			with open(self.path("meta.json"), "r") as file:
+				self.meta = json.load(file)
+			self.open("ab", resume)
+
+			store = BinaryGraphStore(dirname)
+			self.ids = set(store.ids())
+			self.strings = {s: i for i, s in enumerate(store.string_list())}
+			store.close()
+
+		else:
+			os.makedirs(dirname, exist_ok=True)
+			for i in os.listdir(dirname):
+				os.remove(self.path(i))
+
+	def path(self, name):
+		return os.path.join(self.dirname, name)
+
+	def open(self, mode, counts=None):
+		self.types = array_types(self.meta)
+		for name, dtype in self.types.items():
+			if counts is not None:
+				os.truncate(self.path(f"{name}.bin"), counts[name] * np.dtype(dtype).itemsize)
+			self.files[name] = open(self.path(f"{name}.bin"), mode)
+			self.counts[name] = counts[name] if counts is not None else 0
+
+	def start(self, graph:CompactGraphSpec):
+		"""Take the property categories of the first graph for the whole store"""
+		self.meta = {
+			"node_categories": graph.node_categories,
+			"line_categories": graph.line_categories,
+		}
+		with open(self.path("meta.json.tmp"), "w") as file:
+			json.dump(self.meta, file)
+		os.replace(self.path("meta.json.tmp"), self.path("meta.json"))
+		self.open("wb")
+
+	@property
+	def offset(self):
+		return dict(self.counts)
+
+	def append(self, name, values):
+		data = np.asarray(values, dtype=self.types[name])
+		self.files[name].write(data.tobytes())
+		self.counts[name] += len(data)
+
+	def string(self, s):
+		i = self.strings.get(s)
+		if i is None:
+			i = self.strings[s] = len(self.strings)
+			data = str(s).encode("utf-8")
+			self.append("string_start", [self.counts["strings"]])
+			self.append("strings", np.frombuffer(data, dtype=np.uint8))
+		return i
+
+	def add(self, graph:GraphSpec):
+		"""Write graph, unless a graph with its id has already been written"""
+		if graph.id in self.ids:
+			return
+
+		if not isinstance(graph, CompactGraphSpec):
+			if self.meta is None:
+				lines = list(graph.lines.values())
+				line_categories = {k: v for k, v in ScaleLineProperties.items() if len(lines) == 0 or k in lines[0].__getstate__()}
+				graph = CompactGraphSpec.from_graph_spec(graph, StationProperties, line_categories)
+			else:
+				graph = CompactGraphSpec.from_graph_spec(graph, self.meta["node_categories"], self.meta["line_categories"])
+
+		if self.meta is None:
+			self.start(graph)
+
+		for id in [graph.id, *graph.node_ids, *graph.line_ids]:
+			if len(id.encode("utf-8")) > ID_WIDTH:
+				raise ValueError(f"Binary graph store ids can be at most {ID_WIDTH} bytes, not {id}")
+
+		self.append("graph_id", [graph.id])
+		self.append("node_start", [self.counts["node_id"]])
+		self.append("edge_start", [self.counts["edge_src"]])
+		self.append("line_start", [self.counts["line_id"]])
+
+		self.append("node_id", graph.node_ids)
+		self.append("node_name", [self.string(i) for i in graph.node_names])
+		self.append("x", graph.xs)
+		self.append("y", graph.ys)
+		for k, categories in self.meta["node_categories"].items():
+			self.append(f"node.{k}", recode(graph.node_codes[k], graph.node_categories[k], categories))
+
+		self.append("line_id", graph.line_ids)
+		self.append("line_name", [self.string(i) for i in graph.line_names])
+		for k, categories in self.meta["line_categories"].items():
+			self.append(f"line.{k}", recode(graph.line_codes[k], graph.line_categories[k], categories))
+
+		self.append("edge_src", graph.edge_src)
+		self.append("edge_dst", graph.edge_dst)
+		self.append("edge_line", graph.edge_line)
+
+		self.ids.add(graph.id)
+
+	def flush(self):
+		for file in self.files.values():
+			file.flush()
+			os.fsync(file.fileno())
+
+	def close(self):
+		for file in self.files.values():
+			file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+class BinaryGraphStore(object):
+	"""
+	Reads graphs from a binary graph store without parsing or copying them.
+
+	arrays(i) is the i-th graph's slice of every array, as views of the mapped
+	files. graph(i) is a CompactGraphSpec over those views and store[id] is the
+	graph as the plain dict a graph store gives (as read_documents resolves).
+	"""
+
+	def __init__(self, dirname):
+		self.dirname = dirname
+		with open(os.path.join(dirname, "meta.json"), "r") as file:
+			self.meta = json.load(file)
+
+		self.kinds = array_kinds(self.meta)
+		self.data = {}
+		for name, dtype in array_types(self.meta).items():
+			filename = os.path.join(dirname, f"{name}.bin")
+			if os.path.getsize(filename) > 0:
+				self.data[name] = np.memmap(filename, dtype=dtype, mode="r")
+			else:
+				self.data[name] = np.zeros(0, dtype=dtype)
+
+		self.counts = {kind: len(self.data[next(iter(arrays))]) for kind, arrays in self.kinds.items()}
+		self.index = None
+
+	def __len__(self):
+		return self.counts["graph"]
+
+	def ids(self):
+		return [i.decode("ascii") for i in self.data["graph_id"]]
+
+	def index_of(self, id) -> int:
+		if self.index is None:
+			self.index = {id: i for i, id in enumerate(self.ids())}
+		return self.index[id]
+
+	def __contains__(self, id):
+		try:
+			self.index_of(id)
+			return True
+		except KeyError:
+			return False
+
+	def span(self, starts, i, total):
+		start = self.data[starts]
+		end = start[i+1] if i + 1 < len(start) else total
+		return int(start[i]), int(end)
+
+	def string(self, i) -> str:
+		start, end = self.span("string_start", i, self.counts["byte"])
+		return self.data["strings"][start:end].tobytes().decode("utf-8")
+
+	def string_list(self):
+		return [self.string(i) for i in range(self.counts["string"])]
+
+	def arrays(self, i):
+		"""Views of graph i's arrays"""
+		views = {name: self.data[name][i:i+1] for name in self.kinds["graph"]}
+		for kind in ["node", "line", "edge"]:
+			start, end = self.span(f"{kind}_start", i, self.counts[kind])
+			for name in self.kinds[kind]:
+				views[name] = self.data[name][start:end]
+		return views
+
+	def graph(self, i) -> CompactGraphSpec:
+		a = self.arrays(i)
+		node_categories = self.meta["node_categories"]
+		line_categories = self.meta["line_categories"]
+
+		return CompactGraphSpec(
+			node_ids=[j.decode("ascii") for j in a["node_id"]],
+			node_names=[self.string(j) for j in a["node_name"]],
+			xs=a["x"],
+			ys=a["y"],
+			node_codes={k: a[f"node.{k}"] for k in node_categories},
+			node_categories=node_categories,
+			line_ids=[j.decode("ascii") for j in a["line_id"]],
+			line_names=[self.string(j) for j in a["line_name"]],
+			line_codes={k: a[f"line.{k}"] for k in line_categories},
+			line_categories=line_categories,
+			edge_src=a["edge_src"],
+			edge_dst=a["edge_dst"],
+			edge_line=a["edge_line"],
+			id=a["graph_id"][0].decode("ascii"),
+		)
+
+	def __getitem__(self, id):
+		return self.graph(self.index_of(id)).stripped()
+
+	def close(self):
+		self.data = {}
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
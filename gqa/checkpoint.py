@@ -0,0 +1,61 @@
+
+import os
+import os.path
+import json
+import random
+
+import logging
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------
+# Checkpoints for resuming an interrupted generation run
+#
+# Each output file has one current checkpoint {dataset}.checkpoint.json,
+# replaced (write then rename) each time progress is saved, so it is always
+# a complete checkpoint whatever point the run was interrupted at. It records
+# documents written so far, the byte offsets of the output and graph store,
+# the form counters (which the FormScheduler runs from), the state of the
+# `random` module, the seed of any TopologyPool and whether the file is done
+# --------------------------------------------------------------------------
+
+def checkpoint_filename(dataset_filename):
+	return os.path.splitext(dataset_filename)[0] + ".checkpoint.json"
+
+
+def get_random_state():
+	version, internal, gauss_next = random.getstate()
+	return [version, list(internal), gauss_next]
+
+def set_random_state(state):
+	version, internal, gauss_next = state
+	random.setstate((version, tuple(internal), gauss_next))
+
+
+class CheckpointFile(object):
+
+	def __init__(self, filename):
+		self.filename = filename
+
+	def exists(self):
+		return os.path.exists(self.filename)
+
+	def reset(self):
+		"""Remove the checkpoint of an earlier run"""
+		if self.exists():
+			os.remove(self.filename)
+
+	def save(self, checkpoint:dict):
+		tmp = self.filename + ".tmp"
+		with open(tmp, "w") as file:
+			json.dump(checkpoint, file)
+			file.flush()
+			os.fsync(file.fileno())
+		os.replace(tmp, self.filename)
+
+	def load(self):
+		"""The current checkpoint, or None if there isn't one"""
+		if not self.exists():
+			return None
+
+		with open(self.filename, "r") as file:
+			return json.load(file)
@@ -0,0 +1,211 @@
+
+from typing import Dict, List
+from collections import deque
+import numpy as np
+
+from .types import GraphSpec, NodeSpec, EdgeSpec, LineSpec, EdgeIndex, gen_id
+
+# --------------------------------------------------------------------------
+# Compact, array-backed GraphSpec
+#
+# Nodes and lines are integer indices. Their properties are small int codes
+# into per-property category lists, edges are (station, station, line) index
+# arrays and adjacency is CSR. The adjacency, NodeSpec, EdgeSpec and LineSpec
+# views and the networkx graph are only built if something asks for them.
+#
+# Exports exactly as the GraphSpec it stands in for would
+# --------------------------------------------------------------------------
+
+def encode(values, categories):
+	"""values as int codes into categories"""
+	code = {v: i for i, v in enumerate(categories)}
+	return np.array([code[v] for v in values], dtype=np.uint8)
+
+
+def csr(n, src, dst):
+	"""(indptr, indices) of each node's distinct neighbours, in the order their edges come"""
+	a = np.concatenate([src, dst])
+	b = np.concatenate([dst, src])
+	order = np.argsort(np.concatenate([np.arange(len(src))] * 2), kind="stable")
+	a, b = a[order], b[order]
+
+	# Keep the first of any parallel edges
+	_, first = np.unique(a.astype(np.int64) * n + b, return_index=True)
+	keep = np.sort(first)
+	a, b = a[keep], b[keep]
+
+	order = np.argsort(a, kind="stable")
+	indptr = np.zeros(n + 1, dtype=np.int64)
+	np.cumsum(np.bincount(a, minlength=n), out=indptr[1:])
+
+	return indptr, b[order]
+
+
+class CompactGraphSpec(GraphSpec):
+
+	def __init__(self,
+		node_ids:List[str], node_names:List[str], xs, ys,
+		node_codes:Dict[str, np.ndarray], node_categories:Dict[str, list],
+		line_ids:List[str], line_names:List[str],
+		line_codes:Dict[str, np.ndarray], line_categories:Dict[str, list],
+		edge_src, edge_dst, edge_line, id:str=None):
+
+		self.id = id if id is not None else gen_id()
+
+		self.node_ids = node_ids
+		self.node_names = node_names
+		self.xs = xs
+		self.ys = ys
+		self.node_codes = node_codes
+		self.node_categories = node_categories
+
+		self.line_ids = line_ids
+		self.line_names = line_names
+		self.line_codes = line_codes
+		self.line_categories = line_categories
+
+		self.edge_src = edge_src
+		self.edge_dst = edge_dst
+		self.edge_line = edge_line
+
+		self._node_index = None
+		self._csr = None
+		self._nodes = None
+		self._edges = None
+		self._lines = None
+		self._gnx = None
+		self._edge_index = None
+		self._adjacency = None
+
+	@classmethod
+	def from_graph_spec(cls, graph:GraphSpec, node_categories:Dict[str, list], line_categories:Dict[str, list]):
+		"""The compact form of a GraphSpec, coding the given properties of its nodes and lines"""
+		nodes = list(graph.nodes.values())
+		lines = list(graph.lines.values())
+		node_index = {id: i for i, id in enumerate(graph.nodes)}
+		line_index = {id: i for i, id in enumerate(graph.lines)}
+
+		return cls(
+			node_ids=[i["id"] for i in nodes],
+			node_names=[i["name"] for i in nodes],
+			xs=np.array([i["x"] for i in nodes]),
+			ys=np.array([i["y"] for i in nodes]),
+			node_codes={k: encode([i[k] for i in nodes], v) for k, v in node_categories.items()},
+			node_categories=node_categories,
+			line_ids=[i["id"] for i in lines],
+			line_names=[i["name"] for i in lines],
+			line_codes={k: encode([i[k] for i in lines], v) for k, v in line_categories.items()},
+			line_categories=line_categories,
+			edge_src=np.array([node_index[e["station1"]] for e in graph.edges], dtype=np.int32),
+			edge_dst=np.array([node_index[e["station2"]] for e in graph.edges], dtype=np.int32),
+			edge_line=np.array([line_index[e["line_id"]] for e in graph.edges], dtype=np.int32),
+			id=graph.id,
+		)
+
+	@property
+	def edge_index(self) -> EdgeIndex:
+		if self._edge_index is None:
+			self._edge_index = EdgeIndex(self.node_ids, self.line_ids, self.edge_src, self.edge_dst, self.edge_line)
+		return self._edge_index
+
+	@property
+	def node_index(self) -> Dict[str, int]:
+		if self._node_index is None:
+			self._node_index = {id: i for i, id in enumerate(self.node_ids)}
+		return self._node_index
+
+	@property
+	def indptr(self):
+		return self.neighbor_csr()[0]
+
+	@property
+	def indices(self):
+		return self.neighbor_csr()[1]
+
+	def neighbor_csr(self):
+		if self._csr is None:
+			self._csr = csr(len(self.node_ids), self.edge_src, self.edge_dst)
+		return self._csr
+
+	# ----------------------------------------------------------------------
+	# Views, made on first use
+
+	def node(self, i) -> NodeSpec:
+		state = {k: self.node_categories[k][c[i]] for k, c in self.node_codes.items()}
+		state["id"] = self.node_ids[i]
+		state["name"] = self.node_names[i]
+		state["x"] = float(self.xs[i])
+		state["y"] = float(self.ys[i])
+		return NodeSpec(state)
+
+	def line(self, i) -> LineSpec:
+		state = {k: self.line_categories[k][c[i]] for k, c in self.line_codes.items()}
+		state["id"] = self.line_ids[i]
+		state["name"] = self.line_names[i]
+		return LineSpec(state)
+
+	@property
+	def nodes(self) -> Dict[str, NodeSpec]:
+		if self._nodes is None:
+			self._nodes = {id: self.node(i) for i, id in enumerate(self.node_ids)}
+		return self._nodes
+
+	@property
+	def lines(self) -> Dict[str, LineSpec]:
+		if self._lines is None:
+			self._lines = {id: self.line(i) for i, id in enumerate(self.line_ids)}
+		return self._lines
+
+	@property
+	def edges(self) -> List[EdgeSpec]:
+		if self._edges is None:
+			lines = list(self.lines.values())
+			self._edges = [
+				EdgeSpec({
+					"station1": self.node_ids[a],
+					"station1_name": self.node_names[a],
+					"station2": self.node_ids[b],
+					"station2_name": self.node_names[b],
+					"line_id": lines[l]["id"],
+					"line_name": lines[l]["name"],
+					"line_color": lines[l]["color"],
+					"line_stroke": lines[l]["stroke"],
+				})
+				for a, b, l in zip(self.edge_src.tolist(), self.edge_dst.tolist(), self.edge_line.tolist())
+			]
+		return self._edges
+
+	# ----------------------------------------------------------------------
+	# Graph algorithms straight from the arrays
+
+	def neighbor_indices(self, i):
+		return self.indices[self.indptr[i]:self.indptr[i+1]]
+
+	def bfs_parents(self, source):
+		"""Each reachable node's parent in a breadth first search from source, in visiting order"""
+		if self._adjacency is None:
+			self._adjacency = (self.indptr.tolist(), self.indices.tolist())
+		indptr, indices = self._adjacency
+
+		parents = {source: None}
+		queue = deque([source])
+		while queue:
+			u = queue.popleft()
+			for v in indices[indptr[u]:indptr[u+1]]:
+				if v not in parents:
+					parents[v] = u
+					queue.append(v)
+		return parents
+
+	def components(self) -> np.ndarray:
+		"""Connected component number of each node"""
+		component = np.full(len(self.node_ids), -1, dtype=np.int64)
+		n = 0
+		for i in range(len(self.node_ids)):
+			if component[i] < 0:
+				component[list(self.bfs_parents(i))] = n
+				n += 1
+		return component
+
+	def __setstate__(self, state):
+		raise TypeError("A CompactGraphSpec exports as a GraphSpec, load it as one")
@@ -0,0 +1,184 @@
+
+import numpy as np
+import networkx as nx
+from collections import OrderedDict, defaultdict
+from typing import Dict, List
+
+from .types import GraphSpec, NodeSpec, EdgeSpec
+from .compact import CompactGraphSpec
+
+# --------------------------------------------------------------------------
+# Per-graph analysis shared by every question asked of that graph
+# --------------------------------------------------------------------------
+
+class GraphContext(object):
+	"""
+	Wraps a GraphSpec with lazily computed, cached structures that question programs
+	on the graph can share: neighbour and incident edge lists, BFS trees, connected
+	components and property indexes.
+
+	Functional operators are run with a GraphContext in place of the graph. Make one
+	per graph and drop it once that graph's questions are done. Everything it holds
+	is proportional to the graph, apart from the BFS trees of which only the
+	max_bfs_trees most recently used are kept.
+
+	On a CompactGraphSpec, neighbours, BFS trees, components and node property
+	indexes come straight from its arrays rather than from networkx.
+	"""
+
+	def __init__(self, graph:GraphSpec, max_bfs_trees=64):
+		self.graph = graph
+		self.compact = isinstance(graph, CompactGraphSpec)
+		self.max_bfs_trees = max_bfs_trees
+
+		self._node_list = None
+		self._neighbors = {}
+		self._incident_edges = {}
+		self._node_edges = {}
+		self._line_edges = {}
+		self._bfs_trees = OrderedDict()
+		self._components = None
+		self._edge_indexes = {}
+		self._node_indexes = {}
+		self._memo = {}
+
+	@property
+	def id(self):
+		return self.graph.id
+
+	@property
+	def nodes(self) -> Dict[str, NodeSpec]:
+		return self.graph.nodes
+
+	@property
+	def edges(self) -> List[EdgeSpec]:
+		return self.graph.edges
+
+	@property
+	def lines(self):
+		return self.graph.lines
+
+	@property
+	def gnx(self):
+		return self.graph.gnx
+
+	@property
+	def node_list(self) -> List[NodeSpec]:
+		"""The graph's nodes as a list, always the same one so operators can recognise it"""
+		if self._node_list is None:
+			self._node_list = list(self.nodes.values())
+		return self._node_list
+
+	@property
+	def line_list(self):
+		return self.memo("line_list", lambda ctx: list(ctx.lines.values()))
+
+	def memo(self, key, fn):
+		"""fn(self), computed once per graph"""
+		if key not in self._memo:
+			self._memo[key] = fn(self)
+		return self._memo[key]
+
+	def neighbors(self, id) -> List[NodeSpec]:
+		if id not in self._neighbors:
+			if self.compact:
+				g = self.graph
+				self._neighbors[id] = [self.node_list[i] for i in g.neighbor_indices(g.node_index[id]).tolist()]
+			else:
+				self._neighbors[id] = [self.nodes[i] for i in self.gnx.neighbors(id)]
+		return self._neighbors[id]
+
+	def node_edges(self, id) -> List[EdgeSpec]:
+		"""Every edge touching node id, including parallel edges on different lines"""
+		if id not in self._node_edges:
+			edges = self.edges
+			self._node_edges[id] = [edges[i] for i in self.graph.edge_index.of_node(id)]
+		return self._node_edges[id]
+
+	def line_edges(self, id) -> List[EdgeSpec]:
+		"""Every edge of line id, in graph order"""
+		if id not in self._line_edges:
+			edges = self.edges
+			index = self.graph.edge_index
+			self._line_edges[id] = [edges[i] for i in index.of_line(id)] if id in index.line_index else []
+		return self._line_edges[id]
+
+	def incident_edges(self, id):
+		"""As gnx.edges([id], data=True), so only one of any parallel edges"""
+		if id not in self._incident_edges:
+			self._incident_edges[id] = list(self.gnx.edges([id], data=True))
+		return self._incident_edges[id]
+
+	def bfs_tree(self, source_id) -> Dict[str, List[str]]:
+		"""A shortest path (as a list of ids) from source_id to every node reachable from it"""
+		if source_id in self._bfs_trees:
+			self._bfs_trees.move_to_end(source_id)
+		else:
+			if self.compact:
+				self._bfs_trees[source_id] = self.compact_bfs_tree(source_id)
+			else:
+				self._bfs_trees[source_id] = nx.single_source_shortest_path(self.gnx, source_id)
+			if len(self._bfs_trees) > self.max_bfs_trees:
+				self._bfs_trees.popitem(last=False)
+
+		return self._bfs_trees[source_id]
+
+	def compact_bfs_tree(self, source_id) -> Dict[str, List[str]]:
+		g = self.graph
+		paths = {}
+		for v, parent in g.bfs_parents(g.node_index[source_id]).items():
+			id = g.node_ids[v]
+			paths[id] = [id] if parent is None else paths[g.node_ids[parent]] + [id]
+		return paths
+
+	def shortest_path(self, a_id, b_id) -> List[str]:
+		try:
+			return self.bfs_tree(a_id)[b_id]
+		except KeyError:
+			raise nx.exception.NetworkXNoPath(f"No path between {a_id} and {b_id}")
+
+	def component(self, id) -> int:
+		"""Index of the connected component holding node id"""
+		if self._components is None and self.compact:
+			self._components = dict(zip(self.graph.node_ids, self.graph.components().tolist()))
+		elif self._components is None:
+			self._components = {
+				node: idx
+				for idx, component in enumerate(nx.connected_components(self.gnx))
+				for node in component
+			}
+		return self._components[id]
+
+	def has_path(self, a_id, b_id) -> bool:
+		return self.component(a_id) == self.component(b_id)
+
+	def edges_by(self, key) -> Dict[object, List[EdgeSpec]]:
+		"""Edges grouped by the value of their property key, in graph order"""
+		if key not in self._edge_indexes:
+			self._edge_indexes[key] = group_by(self.edges, key)
+		return self._edge_indexes[key]
+
+	def nodes_by(self, key) -> Dict[object, List[NodeSpec]]:
+		"""Nodes grouped by the value of their property key, in graph order"""
+		if key not in self._node_indexes:
+			if self.compact and key in self.graph.node_codes:
+				self._node_indexes[key] = self.compact_nodes_by(key)
+			else:
+				self._node_indexes[key] = group_by(self.node_list, key)
+		return self._node_indexes[key]
+
+	def compact_nodes_by(self, key):
+		codes = self.graph.node_codes[key]
+		groups = defaultdict(list)
+		for code, value in enumerate(self.graph.node_categories[key]):
+			nodes = [self.node_list[i] for i in np.flatnonzero(codes == code).tolist()]
+			if len(nodes) > 0:
+				groups[value] = nodes
+		return groups
+
+
+def group_by(items, key):
+	groups = defaultdict(list)
+	for i in items:
+		groups[i[key]].append(i)
+	return groups
@@ -4,10 +4,11 @@ import networkx as nx
 from collections import Counter
 from inspect import signature
 
-from .types import NodeSpec, EdgeSpec
-from .generate_graph import StationProperties, LineProperties
+from .types import NodeSpec, EdgeSpec, stripped, converter_for, register_converter
+from .context import GraphContext
+from .generate_graph import StationProperties
 
-from typing import List, Dict
+from typing import List
 
 import logging
 logger = logging.getLogger(__name__)
@@ -23,6 +24,10 @@ class FunctionalOperator(object):
 	def __call__(self, graph):
 		"""Execute this whole program to get an answer"""
 
+		# Operators work on a GraphContext, so they can share its cached analysis
+		if not isinstance(graph, GraphContext):
+			graph = GraphContext(graph)
+
 		def ex(item):
 			if isinstance(item, FunctionalOperator):
 				return item(graph)
@@ -49,25 +54,49 @@ class FunctionalOperator(object):
 
 	def stripped(self):
 		"""Represent this program for export"""
+		return stripped(self)
+
+
+def strip_operator(o):
+	return {type(o).__name__: [strip_argument(i) for i in o.args]}
+
+def strip_argument(item):
+	fn = converter_for(type(item))
+	if fn is not None:
+		return fn(item)
+
+	# YAML export will freak out if it hits a lambda, so symbolically replace it
+	if callable(item):
+		args = [LambdaArg(i) for i in signature(item).parameters]
+		return strip_operator(Lambda(item(*args)))
+
+	return item
+
+register_converter(FunctionalOperator, strip_operator)
 
-		def ex(item):
-			try:
-				return item.stripped()
-			except AttributeError:
-
-				# YAML export will freak out if it hits a lambda, so symbolically replace it
-				if callable(item):
-					sig = signature(item)
-					args = [LambdaArg(i) for i in sig.parameters]
-					return Lambda(item(*args)).stripped()
-				else:
-					return item
-
-		k = [ex(i) for i in self.args]
-		
-		r = {}
-		r[type(self).__name__] = k
-		return r
+
+class Slot(FunctionalOperator):
+	"""
+	Stands in for a question's i-th argument, so a form's program can be stripped
+	once into a template (see QuestionForm.stripped_functional). Slots are left in
+	place when stripped, for fill() to replace.
+	"""
+	def __init__(self, index):
+		self.index = index
+		self.args = ()
+
+register_converter(Slot, lambda o: o)
+
+def fill(template, args):
+	"""A copy of a stripped template with each Slot replaced by its argument, stripped"""
+	t = type(template)
+	if t is dict:
+		return {k: fill(v, args) for k, v in template.items()}
+	if t is list:
+		return [fill(v, args) for v in template]
+	if t is Slot:
+		return stripped(args[template.index])
+	return template
 
 def macro(f):
 	return f
@@ -79,17 +108,19 @@ def macro(f):
 
 class Station(FunctionalOperator):
 	@classmethod
-	def get(self, graph):
-		return Station(random.choice(list(graph.nodes.values())))
+	def get(self, graph:GraphContext):
+		return Station(random.choice(graph.node_list))
+
+def nonexistent_station_names(graph:GraphContext):
+	# This needs generalised later
+	actual_station_names = {str(j.name()) for j in graph.nodes.values()}
+	max_stn = len(graph.nodes) * 2
+	return [i for i in range(max_stn) if str(i) not in actual_station_names]
 
 class FakeStationName(FunctionalOperator):
 	@classmethod
-	def get(self, graph):
-		# This needs generalised later
-		actual_station_names = {str(j.name()) for j in graph.nodes.values()}
-		max_stn = len(graph.nodes) * 2
-		nonexistent_stations = [i for i in range(max_stn) if str(i) not in actual_station_names]
-		return FakeStationName(random.choice(nonexistent_stations))
+	def get(self, graph:GraphContext):
+		return FakeStationName(random.choice(graph.memo(nonexistent_station_names, nonexistent_station_names)))
 
 class StationPropertyName(FunctionalOperator):
 	@classmethod
@@ -104,8 +135,8 @@ class StationProperty(FunctionalOperator):
 
 class Line(FunctionalOperator):
 	@classmethod
-	def get(self, graph):
-		return Line(random.choice(list(graph.lines.values())))
+	def get(self, graph:GraphContext):
+		return Line(random.choice(graph.line_list))
 
 class Architecture(FunctionalOperator):
 	@classmethod
@@ -172,26 +203,28 @@ class AllEdges(FunctionalOperator):
 
 class AllNodes(FunctionalOperator):
 	def op(self, graph):
-		return graph.nodes.values()
+		return graph.node_list
 
 class Edges(FunctionalOperator):
+	"""Every edge of a node (or list of nodes), including each line of a shared track segment"""
 	def op(self, graph, a):
 		if isinstance(a, NodeSpec):
-			return [edge[2]['attr_dict'] for edge in graph.gnx.edges([a["id"]], data=True)]
+			return list(graph.node_edges(a["id"]))
 		else:
 			return [
-				edge[2]['attr_dict'] 
+				edge
 				for node in a
-				for edge in graph.gnx.edges([node["id"]], data=True) 
+				for edge in graph.node_edges(node["id"])
 			]
 
 class Nodes(FunctionalOperator):
 	def op(self, graph, edges:EdgeSpec):
-		n = []
-		for i in edges:
-			n.append(graph.nodes[i["station1"]])
-			n.append(graph.nodes[i["station2"]])
-		return list(set(n))
+		ids = dict.fromkeys(
+			id
+			for i in edges
+			for id in (i["station1"], i["station2"])
+		)
+		return [graph.nodes[i] for i in ids]
 
 
 def ids_to_nodes(graph, ids):
@@ -200,7 +233,7 @@ def ids_to_nodes(graph, ids):
 class ShortestPath(FunctionalOperator):
 	def op(self, graph, a:NodeSpec, b:NodeSpec, fallback):
 		try:
-			return ids_to_nodes(graph, nx.shortest_path(graph.gnx, a["id"], b["id"]))
+			return ids_to_nodes(graph, graph.shortest_path(a["id"], b["id"]))
 		except nx.exception.NetworkXNoPath:
 			return fallback
 
@@ -226,7 +259,7 @@ class HasCycle(FunctionalOperator):
 			return (frozenset(e[:2]), e[2]["attr_dict"]["line_id"])
 
 		def dfs_unidirected_cycle(head_id, path_nodes=frozenset(), path_edges=frozenset(), indent=""):
-			for e in graph.gnx.edges([head_id], data=True):
+			for e in graph.incident_edges(head_id):
 				assert e[0] == head_id
 				assert head_id in path_nodes
 
@@ -263,15 +296,15 @@ class FilterAdjacent(FunctionalOperator):
 	def op(self, graph, a:List, b:List):
 		r = []
 		for i in a:
+			ns = {n["id"] for n in graph.neighbors(i["id"])}
 			for j in b:
-				ns = graph.gnx.neighbors(i["id"])
 				if j["id"] in ns:
 					r.append([i,j])
 		return r
 
 class Neighbors(FunctionalOperator):
 	def op(self, graph, station:NodeSpec):
-		return ids_to_nodes(graph, graph.gnx.neighbors(station["id"]))
+		return list(graph.neighbors(station["id"]))
 
 class WithinHops(FunctionalOperator):
 	def op(self, graph, station:NodeSpec, hops:int):
@@ -280,7 +313,7 @@ class WithinHops(FunctionalOperator):
 		for i in range(hops):
 			next_tips = set()
 			for j in tips:
-				next_tips |= set(ids_to_nodes(graph, graph.gnx.neighbors(j["id"])))
+				next_tips |= set(graph.neighbors(j["id"]))
 
 			rs |= tips
 			tips = next_tips - rs
@@ -295,7 +328,7 @@ class WithinHops(FunctionalOperator):
 
 class FilterHasPathTo(FunctionalOperator):
 	def op(self, graph, a:List, b:NodeSpec):
-		return [i for i in a if nx.has_path(graph.gnx, i["id"], b["id"])]
+		return [i for i in a if graph.has_path(i["id"], b["id"])]
 
 
 # --------------------------------------------------------------------------
@@ -367,6 +400,14 @@ class Intersection(FunctionalOperator):
 
 class Filter(FunctionalOperator):
 	def op(self, graph, a:List, b, c):
+		# Filtering the whole graph is answered from its property indexes
+		if a is graph.edges and b == "line_id":
+			return list(graph.line_edges(c))
+		if a is graph.edges:
+			return list(graph.edges_by(b).get(c, []))
+		if a is graph.node_list:
+			return list(graph.nodes_by(b).get(c, []))
+
 		return [i for i in a if i[b] == c]
 
 class Without(FunctionalOperator):
@@ -2,141 +2,514 @@
 
 import os
 import os.path
-import yaml
+import json
 import random
+import time
 import uuid
-import sys
-import traceback
+import multiprocessing
+import numpy as np
 from tqdm import tqdm
 from collections import Counter
-
-from .questions import question_forms
-from .generate_graph import GraphGenerator
+from contextlib import ExitStack
+
+from .questions import question_forms, NoValidArguments
+from .generate_graph import GraphGenerator, TopologyPool
+from .context import GraphContext
+from .writer import writers
+from .graph_store import GraphStoreWriter, graph_store_filename
+from .binary_store import BinaryGraphStoreWriter, binary_store_filename
+from .index import DocumentIndexWriter, offsets_filename
+from .render import Renderer
+from .scheduler import FormScheduler, AllFormsFailed, split_evenly
+from .checkpoint import CheckpointFile, checkpoint_filename, get_random_state, set_random_state
+from .telemetry import telemetry
+from .profiling import profiler, profile_filename, merge_profiles
 from .types import *
 from .args import *
 
 import logging
 logger = logging.getLogger(__name__)
 
-if __name__ == "__main__":
 
-	args = get_args()
+def type_matches(args, form):
 
-	logging.basicConfig()
-	logger.setLevel(args.log_level)
-	logging.getLogger('gqa').setLevel(args.log_level)
+	if args.group is not None:
+		if form.group == args.group:
+			return True
+		else:
+			return False
+
+	if args.type_prefix is not None:
+		for i in args.type_prefix:
+			if form.type_string.startswith(i):
+				return True
+		return False
+
+	return True
+
+
+def plan_quotas(args, total_gqa):
+	"""Target count per type_string: those given by --quota, or else total_gqa split evenly between matching forms"""
+
+	if args.quota is not None:
+		known = {i.type_string for i in question_forms}
+		quotas = {}
+		for i in args.quota:
+			type_string, count = i.split("=")
+			if type_string not in known:
+				raise ValueError(f"Unknown question type {type_string}")
+			quotas[type_string] = int(count)
+		return quotas
+
+	matching = [i for i in question_forms if type_matches(args, i)]
+	if len(matching) == 0:
+		raise Exception(f"Could not find form that matches {args.type_prefix}")
+
+	return {
+		form.type_string: count
+		for form, count in zip(matching, split_evenly(total_gqa, len(matching)))
+	}
+
+
+def specs(args, quotas, f_try, f_success, draw_prefix="graph", position=0, start=0, checkpoint=None, topologies=None):
+	"""
+	Generate documents numbered start onwards until every type_string has met its quota,
+	counting form attempts and successes as we go.
+
+	If given, checkpoint(i) is called before each new graph, by which time every
+	document yielded so far has been consumed. With args.graph_batch it is only
+	called between batches, so a checkpoint's random state starts a new batch.
+	If given a TopologyPool, graphs are made by resampling its topologies rather
+	than from scratch.
+	"""
+
+	scheduler = FormScheduler(question_forms, quotas, f_try, f_success,
+		max_retries=args.form_retries,
+		use_cost=args.cost_aware_retries)
+	total_gqa = sum(quotas.values())
+
+	i = start
+	fail = 0
+	batch = []
+	# An empty ExitStack does nothing, as contextlib.nullcontext (3.7+) would
+	renderer = Renderer(os.path.join("data", draw_prefix),
+		format=args.draw_format,
+		size=args.draw_size,
+		dpi=args.draw_dpi,
+		workers=args.draw_workers) if args.draw else ExitStack()
+
+	with tqdm(total=total_gqa, initial=start, position=position) as pbar, renderer:
+		while not scheduler.done:
+
+			if checkpoint is not None and len(batch) == 0:
+				checkpoint(i)
+
+			# The form being attempted, to charge any exception that escapes to it
+			current = None
+			try:
+				t = time.perf_counter()
+				with telemetry.timer("graph"), profiler.phase("graph"):
+					if args.graph_batch > 1:
+						if len(batch) == 0 and topologies is not None:
+							batch = topologies.generate_batch(args, args.graph_batch)[::-1]
+						elif len(batch) == 0:
+							batch = GraphGenerator(args).generate_batch(args.graph_batch)[::-1]
+						graph = batch.pop()
+					elif topologies is not None:
+						graph = topologies.generate(args)
+					else:
+						graph = GraphGenerator(args).generate()
+					g = graph.graph_spec
+				scheduler.record_graph(time.perf_counter() - t)
+				logger.debug("Generated graph")
+
+				if len(g.nodes) == 0 or len(g.edges) == 0:
+					raise ValueError("Empty graph was generated")
+
+				if args.draw:
+					renderer.submit(g)
+
+				# Shared by all the questions on this graph, and dropped with it
+				ctx = GraphContext(g)
+
+				j = 0
+				tried = Counter()
+				while j < args.questions_per_graph:
+					form = scheduler.next_form(tried)
+					if form is None:
+						break
+
+					tried[form.type_string] += 1
+					f_try[form.type_string] += 1
+					current = form.type_string
+					t = time.perf_counter()
+
+					logger.debug(f"Generating question '{form.english}'")
+					try:
+						with profiler.phase("form"):
+							q, a = form.generate(ctx, args)
+						f_success[form.type_string] += 1
+					except NoValidArguments as ex:
+						# Retrying can't help on this graph
+						logger.debug(f"Exception {ex} whilst trying to generate GQA")
+						telemetry.reject(form.type_string, ex)
+						scheduler.give_up_on_graph(form, tried)
+						continue
+					except ValueError as ex:
+						# Not possible on this graph with these arguments, try again
+						logger.debug(f"Exception {ex} whilst trying to generate GQA")
+						telemetry.reject(form.type_string, ex)
+						continue
+					finally:
+						seconds = time.perf_counter() - t
+						scheduler.record(form, seconds)
+						if telemetry.enabled:
+							telemetry.record("question", seconds, form.type_string)
+
+					current = None
+
+					i += 1
+					j += 1
+					pbar.update(1)
+
+					logger.debug(f"Question: '{q}', answer: '{a}'")
+
+					if args.omit_graph:
+						yield DocumentSpec(None,q,a)
+					else:
+						yield DocumentSpec(g,q,a)
+
+			except AllFormsFailed:
+				raise
+
+			except Exception as ex:
+				logger.debug(f"Exception {ex} whilst trying to generate GQA")
+				telemetry.reject(current, ex)
+
+				# ValueError is deemed to mean "should not generate" and not a bug in the underlying code
+				if not isinstance(ex, ValueError):
+					fail += 1
+					if fail >= max(total_gqa / 3, len(question_forms)):
+						raise Exception(f"{ex} --- Too many exceptions whilst trying to generate GQA, stopping.")
+
+	scheduler.log_stats()
+
+
+def generate_file(args, filename, quotas, f_try, f_success, **kwargs):
+	"""
+	Generate documents to meet quotas into filename in args.format, moving graphs out
+	to a graph store if asked to.
+
+	Progress is checkpointed every args.checkpoint_every documents, and with args.resume
+	an interrupted file is continued from its last checkpoint. With args.profile the
+	run is profiled into a file alongside.
+	"""
+
+	Writer = writers[args.format]
+	store_filename = graph_store_filename(filename)
+	checkpoints = CheckpointFile(checkpoint_filename(filename))
+
+	if args.resume and not Writer.resumable:
+		raise ValueError(f"Cannot resume {args.format} output")
+
+	if args.index and not Writer.indexable:
+		raise ValueError(f"Cannot index {args.format} output")
+
+	checkpointing = Writer.resumable and args.checkpoint_every > 0
+	last = checkpoints.load() if args.resume else None
+
+	if last is not None:
+		f_try.update(last["f_try"])
+		f_success.update(last["f_success"])
+
+		if last["done"]:
+			logger.info(f"{filename} is already complete")
+			return
+
+		logger.info(f"Resuming {filename} from document {last['documents']}")
+		os.truncate(filename, last["offset"])
+		if args.graph_store == "jsonl":
+			os.truncate(store_filename, last["graph_store_offset"])
+
+		set_random_state(last["random_state"])
+		topology_seed = last.get("topology_seed")
+		start = last["documents"]
+		mode = Writer.mode.replace("w", "a")
 
-	if args.name is not None:
-		name = args.name
 	else:
-		name = uuid.uuid4()
+		checkpoints.reset()
+		start = 0
+		mode = Writer.mode
+		topology_seed = random.getrandbits(64) if args.topologies > 0 else None
+
+	topologies = TopologyPool(args, args.topologies, topology_seed) if args.topologies > 0 else None
+
+	if args.profile is not None:
+		profiler.start(args.profile, args.profile_phase, args.profile_interval)
+
+	try:
+		with open(filename, mode) as file:
+			with Writer(file) as writer:
+				if args.graph_store == "binary":
+					store = BinaryGraphStoreWriter(binary_store_filename(filename), resume=last["graph_store_offset"] if last is not None else None)
+				elif args.graph_store == "jsonl":
+					store = GraphStoreWriter(store_filename, resume=last is not None)
+				else:
+					store = None
+				index = DocumentIndexWriter(offsets_filename(filename), resume=start if last is not None else None) if args.index else None
+				prev = [start]
+
+				def checkpoint(i, done=False):
+					if not done and i - prev[0] < args.checkpoint_every:
+						return
+					# A file finished before its first checkpoint is redone by a resume, no need for one
+					if done and not checkpoints.exists():
+						return
+					prev[0] = i
+
+					writer.flush()
+					file.flush()
+					os.fsync(file.fileno())
+					if store is not None:
+						store.flush()
+					if index is not None:
+						index.flush()
+
+					checkpoints.save({
+						"documents": i,
+						"offset": file.tell(),
+						"graph_store_offset": store.offset if store is not None else None,
+						"f_try": dict(f_try),
+						"f_success": dict(f_success),
+						"random_state": get_random_state(),
+						"topology_seed": topology_seed,
+						"done": done,
+					})
+
+				docs = specs(args, quotas, f_try, f_success,
+					start=start,
+					checkpoint=checkpoint if checkpointing else None,
+					topologies=topologies,
+					**kwargs)
+
+				for doc in docs:
+					with telemetry.timer("serialize", doc.question.type_string), profiler.phase("serialize"):
+						if store is not None and doc.graph is not None:
+							store.add(doc.graph)
+							doc = DocumentSpec(GraphRef(doc.graph.id), doc.question, doc.answer)
+						offset = writer.tell()
+						writer.write(doc)
+						if index is not None:
+							index.add(offset, writer.tell() - offset)
+
+				if checkpointing:
+					checkpoint(sum(quotas.values()), done=True)
+
+				if store is not None:
+					store.close()
+				if index is not None:
+					index.close()
+	finally:
+		if args.profile is not None:
+			profiler.stop(profile_filename(filename, args.profile))
+
+
+def log_form_stats(f_try, f_success):
+	logger.info(f"GQA per question type: {f_success}")
+
+	for i in f_try:
+		if i in f_success:
+			if f_success[i] < f_try[i]:
+				logger.warn(f"Question form {i} failed to generate {f_try[i] - f_success[i]}/{f_try[i]}")
+		else:
+			logger.warn(f"Question form {i} totally failed to generate")
+
+
+# --------------------------------------------------------------------------
+# Sharded generation across a process pool
+# --------------------------------------------------------------------------
+
+def plan_shards(name, quotas, workers, seed, extension="yaml"):
+	"""Split the quotas into one shard per worker, each with a seed derived from the master seed"""
+
+	n = max(1, min(workers, sum(quotas.values())))
+	seeds = np.random.SeedSequence(seed).spawn(n)
+
+	# Stagger the remainders so that shard sizes stay balanced
+	shard_quotas = [{} for idx in range(n)]
+	for offset, (type_string, quota) in enumerate(quotas.items()):
+		for idx, count in enumerate(split_evenly(quota, n, offset)):
+			if count > 0:
+				shard_quotas[idx][type_string] = count
+
+	return [
+		{
+			"index": idx,
+			"filename": f"./data/gqa-{name}-{idx:04d}.{extension}",
+			"count": sum(shard_quotas[idx].values()),
+			"quotas": shard_quotas[idx],
+			"seed": int(seeds[idx].generate_state(1)[0]),
+		}
+		for idx in range(n)
+	]
+
+
+def generate_shard(args, shard):
+	"""Pool worker: write one shard and report its form counters"""
 
-	total_gqa = args.count * 1000
-	if args.just_one:
-		total_gqa = 1
+	logging.basicConfig()
+	logging.getLogger('gqa').setLevel(args.log_level)
 
-	filename = f"./data/gqa-{name}.yaml"
-	logger.info(f"Generating {total_gqa} (G,Q,A) tuples into {filename}")
+	random.seed(shard["seed"])
+	telemetry.enabled = args.report
+	telemetry.reset()
 
-	os.makedirs("./data", exist_ok=True)
+	f_try = Counter()
+	f_success = Counter()
 
-	def type_matches(form):
+	generate_file(args, shard["filename"], shard["quotas"], f_try, f_success,
+		draw_prefix=f"graph-{shard['index']:04d}",
+		position=shard["index"])
 
-		if args.group is not None:
-			if form.group == args.group:
-				return True
-			else:
-				return False
-		
-		if args.type_prefix is not None:
-			for i in args.type_prefix:
-				if form.type_string.startswith(i):
-					return True
-			return False
+	return {
+		**shard,
+		"f_try": dict(f_try),
+		"f_success": dict(f_success),
+		"telemetry": telemetry.state() if args.report else None,
+	}
 
-		return True
 
+def write_manifest(filename, manifest):
+	with open(filename, "w") as file:
+		json.dump(manifest, file, indent=2)
 
+
+def write_report(filename, f_try, f_success):
 	with open(filename, "w") as file:
+		json.dump(telemetry.report(f_try, f_success), file, indent=2)
 
-		f_try = Counter()
-		f_success = Counter()
 
-		def forms():
-			while True:
-				for form in question_forms:
-					yield form
+def generate_sharded(args, name, quotas):
 
-		def specs():
-			form_gen = forms()
-			i = 0
-			fail = 0
-			with tqdm(total=total_gqa) as pbar:
-				while i < total_gqa:
+	manifest_filename = f"./data/gqa-{name}.manifest.json"
 
-					try:
-						graph = GraphGenerator(args)
-						graph.generate()
-						g = graph.graph_spec
-						logger.debug("Generated graph")
+	if args.resume and os.path.exists(manifest_filename):
+		# Carry on with the seed the interrupted run chose
+		with open(manifest_filename, "r") as file:
+			seed = json.load(file)["seed"]
+	elif args.seed is not None:
+		seed = args.seed
+	else:
+		seed = np.random.SeedSequence().entropy
+
+	shards = plan_shards(name, quotas, args.workers, seed, args.format)
+
+	# Spawned workers take their str hash seed from the environment, which
+	# pins set iteration order and so makes the whole shard reproducible
+	hash_seed = int(np.random.SeedSequence(seed).generate_state(1)[0])
+
+	manifest = {
+		"name": str(name),
+		"seed": seed,
+		"hash_seed": hash_seed,
+		"workers": args.workers,
+		"count": sum(quotas.values()),
+		"quotas": quotas,
+		"args": vars(args),
+		"shards": shards,
+	}
+
+	# Written up front as well as at the end so that --resume can find the seed
+	write_manifest(manifest_filename, manifest)
+
+	prev_hash_seed = os.environ.get("PYTHONHASHSEED")
+	os.environ["PYTHONHASHSEED"] = str(hash_seed)
+
+	try:
+		ctx = multiprocessing.get_context("spawn")
+		with ctx.Pool(len(shards)) as pool:
+			results = pool.starmap(generate_shard, [(args, shard) for shard in shards])
+	finally:
+		if prev_hash_seed is None:
+			del os.environ["PYTHONHASHSEED"]
+		else:
+			os.environ["PYTHONHASHSEED"] = prev_hash_seed
+
+	f_try = Counter()
+	f_success = Counter()
+	for r in results:
+		f_try.update(r["f_try"])
+		f_success.update(r["f_success"])
+
+		# Shard timings go into the run report rather than the manifest
+		state = r.pop("telemetry")
+		if state is not None:
+			telemetry.merge(state)
+
+	if args.profile is not None:
+		merge_profiles(
+			[profile_filename(i["filename"], args.profile) for i in shards],
+			profile_filename(f"./data/gqa-{name}.{writers[args.format].extension}", args.profile),
+			args.profile)
+
+	manifest["shards"] = results
+	manifest["f_try"] = dict(f_try)
+	manifest["f_success"] = dict(f_success)
+	write_manifest(manifest_filename, manifest)
+
+	return f_try, f_success
 
-						if len(g.nodes) == 0 or len(g.edges) == 0:
-							raise ValueError("Empty graph was generated")
 
+if __name__ == "__main__":
 
-						j = 0
-						attempt = 0
-						while j < args.questions_per_graph:
-							form = next(form_gen)
-							attempt += 1
+	args = get_args()
 
-							if type_matches(form):
+	logging.basicConfig()
+	logger.setLevel(args.log_level)
+	logging.getLogger('gqa').setLevel(args.log_level)
+
+	if args.name is not None:
+		name = args.name
+	elif args.resume:
+		raise ValueError("--resume needs the --name of the run to continue")
+	else:
+		name = uuid.uuid4()
+
+	total_gqa = args.count * 1000
+	if args.just_one:
+		total_gqa = 1
 
-								f_try[form.type_string] += 1
-								
-								logger.debug(f"Generating question '{form.english}'")
-								q, a = form.generate(g, args)
+	quotas = plan_quotas(args, total_gqa)
+	total_gqa = sum(quotas.values())
 
-								f_success[form.type_string] += 1
-								i += 1
-								j += 1
-								pbar.update(1)
+	os.makedirs("./data", exist_ok=True)
 
-								logger.debug(f"Question: '{q}', answer: '{a}'")
+	telemetry.enabled = args.report
+	telemetry.reset()
 
-								if args.draw:
-									graph.draw(os.path.join("data", f"graph-{i}.png"))
+	if args.workers is not None:
+		logger.info(f"Generating {total_gqa} (G,Q,A) tuples into ./data/gqa-{name}-*.{args.format} with {args.workers} workers")
+		f_try, f_success = generate_sharded(args, name, quotas)
 
-								if args.omit_graph:
-									yield DocumentSpec(None,q,a).stripped()
-								else:
-									yield DocumentSpec(g,q,a).stripped()
+	else:
+		filename = f"./data/gqa-{name}.{writers[args.format].extension}"
+		logger.info(f"Generating {total_gqa} (G,Q,A) tuples into {filename}")
 
-							if attempt > len(question_forms) * 3:
-								raise Exception(f"Could not find form that matches {args.type_prefix}")
-							
-					except Exception as ex:
-						logger.debug(f"Exception {ex} whilst trying to generate GQA")
+		if args.seed is not None:
+			random.seed(args.seed)
 
-						# ValueError is deemed to mean "should not generate" and not a bug in the underlying code
-						if not isinstance(ex, ValueError):
-							fail += 1
-							if fail >= max(total_gqa / 3, len(question_forms)):
-								raise Exception(f"{ex} --- Too many exceptions whilst trying to generate GQA, stopping.")
-							
+		f_try = Counter()
+		f_success = Counter()
 
-		yaml.dump_all(specs(), file, explicit_start=True)
+		generate_file(args, filename, quotas, f_try, f_success)
 
-		logger.info(f"GQA per question type: {f_success}")
+	log_form_stats(f_try, f_success)
 
-		for i in f_try:
-			if i in f_success: 
-				if f_success[i] < f_try[i]:
-					logger.warn(f"Question form {i} failed to generate {f_try[i] - f_success[i]}/{f_try[i]}")
-			else:
-				logger.warn(f"Question form {i} totally failed to generate")
+	if args.report:
+		report_filename = f"./data/gqa-{name}.report.json"
+		write_report(report_filename, f_try, f_success)
+		logger.info(f"Wrote run report to {report_filename}")
 
-				
 
 
 
@@ -1,19 +1,19 @@
 
-import uuid
+import gc
+import copy
 import random
+import math
+import itertools
 import numpy as np
-import scipy
-from sklearn.neighbors import KDTree
-import networkx as nx
-import bezier
-import gibberish
 import logging
-from collections import OrderedDict, Counter
-from tqdm import tqdm
 
 logger = logging.getLogger(__name__)
 
-from .types import GraphSpec, NodeSpec, EdgeSpec, LineSpec
+from .types import GraphSpec, NodeSpec, EdgeSpec, LineSpec, UNSET, gen_ids
+from .compact import CompactGraphSpec
+from .telemetry import telemetry
+from .names import name_pool, int_names
+from .render import drawing, render
 from .args import *
 
 LineProperties = {
@@ -23,6 +23,16 @@ LineProperties = {
 	"built": ["50s", "60s", "70s", "80s", "90s", "00s", "recent"],
 }
 
+# Lines in scale mode (--lines/--stations-per-line) are drawn from a wider range
+# of properties, so thousands of lines aren't all alike
+ScaleLineProperties = {
+	**LineProperties,
+	"color": LineProperties["color"] + ['gray', 'navy', 'teal', 'maroon', 'gold', 'lime', 'magenta', 'coral', 'indigo', 'turquoise', 'khaki', 'salmon'],
+	"built": ["1900s", "10s", "20s", "30s", "40s"] + LineProperties["built"],
+	"frequency": ["2 min", "5 min", "10 min", "15 min", "30 min", "hourly"],
+	"depth": ["surface", "elevated", "cut-and-cover", "deep tube"],
+}
+
 StationProperties = {
 	"disabled_access": [True, False],
 	"has_rail": [True, False],
@@ -32,54 +42,159 @@ StationProperties = {
 	"cleanliness": ["clean", 'dirty', 'shabby', 'derilict', 'rat-infested'],
 }
 
-OtherProperties = {
-	"surname": [" street", " st", " road", " court", " grove", "bridge", " bridge", " lane", " way", " boulevard", " crossing", " square", "ham", ' on trent', ' upon Thames', ' international', ' hospital', 'neyland', 'ington', 'ton', 'wich', ' manor', ' estate', ' palace']
-}
-
-class GeneratedEntity(object):
-	def __init__(self, properties):
-		self.p = properties
-		self.p["id"] = str(uuid.uuid4())
-
-	def __hash__(self):
-		h = [self.p[i] for i in type(self).hash_properties]
-		return hash(frozenset(h))
-
-	def __repr__(self):
-		return str(self.p)
-
+def gen_n(base):
+	return base
 
-class GeneratedStation(GeneratedEntity):
-	hash_properties = ["name"]
+def binomial(n, k):
+	return math.factorial(n) // (math.factorial(k) * math.factorial(n - k))
+
+def bezier_basis(n, degree=3):
+	"""Bernstein polynomials at n evenly spaced points, so that control_points @ basis evaluates the curve"""
+	t = np.linspace(0, 1, n)
+	return np.array([
+		binomial(degree, k) * t**k * (1 - t)**(degree - k)
+		for k in range(degree + 1)
+	])
+
+
+def nearby_pairs(pts, radius):
+	"""Index pairs (i, j), i < j, of points at most radius apart, found with a grid spatial hash.
+
+	Each point is bucketed into a square cell of side radius, so its neighbours
+	lie in the same or an adjacent cell. Points are sorted by cell, and each
+	point's candidates in a neighbouring cell are found by binary search, so
+	this is O(n log n). Only half the adjacent cells are checked, so each pair
+	of cells is compared once. Points are visited in cell order, so the searches
+	(and the reads of candidate points) go through memory in order.
+	"""
+	n = len(pts)
+	cells = np.floor(pts / radius).astype(np.int64)
+	cells -= cells.min(axis=0)
+
+	# One key per cell. The spare rows mean a key one cell out is never a real cell
+	width = cells[:, 1].max() + 3
+	keys = cells[:, 0] * width + cells[:, 1]
+	order = np.argsort(keys, kind="stable")
+	sorted_keys = keys[order]
+	sorted_pts = pts[order]
+
+	r2 = radius * radius
+	pairs = []
+	for dx, dy in ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1)):
+		target = sorted_keys + dx * width + dy
+		start = np.searchsorted(sorted_keys, target, side="left")
+		counts = np.searchsorted(sorted_keys, target, side="right") - start
+
+		# Every (point, point in the target cell) candidate, as positions in cell order
+		i = np.repeat(np.arange(n), counts)
+		within = np.arange(len(i)) - np.repeat(np.cumsum(counts) - counts, counts)
+		j = np.repeat(start, counts) + within
+
+		d = sorted_pts[i] - sorted_pts[j]
+		close = (d * d).sum(axis=-1) <= r2
+		if (dx, dy) == (0, 0):
+			close &= i < j
+
+		i, j = order[i[close]], order[j[close]]
+		pairs.append(np.stack([np.minimum(i, j), np.maximum(i, j)], axis=-1))
+
+	return np.concatenate(pairs)
+
+def union_find(n, pairs):
+	"""Map each of n items to the smallest index in its connected component, given an array of (i, j) pairs linking them.
+
+	Each round links the larger root of every pair to the smaller, then points
+	every item straight at its root, until each pair shares a root. Roots only
+	ever get smaller, so each component ends up rooted at its smallest index and
+	the earliest station survives.
+	"""
+	root = np.arange(n)
+	i, j = pairs[:, 0], pairs[:, 1]
+
+	while True:
+		ri, rj = root[i], root[j]
+		if np.array_equal(ri, rj):
+			return root
+
+		np.minimum.at(root, np.maximum(ri, rj), np.minimum(ri, rj))
+
+		while True:
+			parent = root[root]
+			if np.array_equal(parent, root):
+				break
+			root = parent
+
+
+class Topology(object):
+	"""
+	Where the stations of one or more graphs are and the edges between them, stacked.
+
+	Graph i has the stations node_start[i]:node_start[i+1] of xs and ys, the lines
+	line_start[i]:line_start[i+1] and the edges edge_start[i]:edge_start[i+1]. Each
+	edge is a (station, station, line) triple of indices within its own graph.
+	"""
+
+	def __init__(self, xs, ys, edge_src, edge_dst, edge_line, node_start, line_start, edge_start):
+		self.xs = xs
+		self.ys = ys
+		self.edge_src = edge_src
+		self.edge_dst = edge_dst
+		self.edge_line = edge_line
+		self.node_start = node_start
+		self.line_start = line_start
+		self.edge_start = edge_start
+
+	@classmethod
+	def stack(cls, topologies):
+		"""One Topology holding every graph of topologies, in order"""
+		def starts(name):
+			s = [getattr(t, name) for t in topologies]
+			ends = np.cumsum([i[-1] for i in s])
+			return np.concatenate([i[:-1] + (end - i[-1]) for i, end in zip(s, ends)] + [ends[-1:]])
+
+		return cls(
+			*[np.concatenate([getattr(t, k) for t in topologies]) for k in ["xs", "ys", "edge_src", "edge_dst", "edge_line"]],
+			starts("node_start"), starts("line_start"), starts("edge_start"),
+		)
 
-	@property
-	def pt(self):
-		return [self.p["x"], self.p["y"]]
+	def __len__(self):
+		return len(self.node_start) - 1
+
+	def graph(self, i):
+		"""Graph i on its own"""
+		n0, n1 = self.node_start[i], self.node_start[i+1]
+		e0, e1 = self.edge_start[i], self.edge_start[i+1]
+		return Topology(
+			self.xs[n0:n1], self.ys[n0:n1],
+			self.edge_src[e0:e1], self.edge_dst[e0:e1], self.edge_line[e0:e1],
+			np.array([0, n1 - n0]),
+			np.array([0, self.line_start[i+1] - self.line_start[i]]),
+			np.array([0, e1 - e0]),
+		)
 
-	def dist(self, other):
-		return scipy.spatial.distance.euclidean(self.pt, other.pt)
 
-	def __repr__(self):
-		return self.p["name"]
-	
-class GeneratedLine(GeneratedEntity):
-	hash_properties = ["color", "stroke"]
-
-	def to_attr_dict(self):
-		return {
-			"line_id":    self.p["id"],
-			"line_name":  self.p["name"],
-			"line_color": self.p["color"],
-			"line_stroke": self.p["stroke"],
-		}
+def sample_codes(rng, properties, n):
+	"""n random codes into each property's categories, from one call to rng"""
+	sizes = np.array([len(v) for v in properties.values()])
+	codes = rng.integers(sizes[:, None], size=(len(sizes), n), dtype=np.uint8)
+	return dict(zip(properties, codes))
 
+def decoded(codes, categories):
+	"""Property codes as a list of the values they stand for"""
+	return np.array(categories, dtype=object)[codes].tolist()
 
-def gen_n(base, noise = 0.2):
-	return base
-	return round(random.gauss(base, noise*base))
+def records(cls, columns):
+	"""A cls record per row of columns, a dict of equal length lists by field. Missing fields are left unset"""
+	unset = itertools.repeat(UNSET)
 
-def add_noise(base, noise=0.05):
-	return base * (1 - noise + random.random() * noise*2)
+	# Records hold no reference cycles, so don't let making millions of them set off collections
+	enabled = gc.isenabled()
+	gc.disable()
+	try:
+		return [cls.from_values(list(row)) for row in zip(*[columns.get(k, unset) for k in cls.fields])]
+	finally:
+		if enabled:
+			gc.enable()
 
 
 class GraphGenerator(object):
@@ -107,204 +222,307 @@ class GraphGenerator(object):
 			self.stats["map_radius"] = 4
 			# self.stats["min_station_dist"] = 2
 
+		self.line_properties = LineProperties
+		if args.lines is not None or args.stations_per_line is not None:
+			self.scale_stats(args)
 
-	def gen_a(self, Clz, prop_dict):
-		return Clz({
-			k : random.choice(prop_dict[k])
-			for k in prop_dict.keys()
-		})
+		if args.map_radius is not None:
+			self.stats["map_radius"] = args.map_radius
 
-	def gen_line(self):
-		l = self.gen_a(GeneratedLine, LineProperties)
-		name = l.p["color"] + " " + gibberish.generate_word()
-		l.p["name"] = name.title()
-		return l
+	def scale_stats(self, args):
+		"""Size the graph from --lines and --stations-per-line, spreading the map to keep station density the same"""
+		before = self.stats["lines"] * self.stats["stations_per_line"]
 
-	def gen_station(self):
-		s = self.gen_a(GeneratedStation, StationProperties)
-		name = gibberish.generate_word() + random.choice(OtherProperties["surname"])
-		s.p["name"] = name.title()
-		return s
+		if args.lines is not None:
+			self.stats["lines"] = args.lines
+		if args.stations_per_line is not None:
+			self.stats["stations_per_line"] = args.stations_per_line
 
-	@property
-	def station_set(self):
-		line_stations_set = set()
-		for line, stations in self.line_stations.items():
-			line_stations_set.update(stations)
-		return line_stations_set
-	
+		after = self.stats["lines"] * self.stats["stations_per_line"]
+		self.stats["map_radius"] *= math.sqrt(after / before)
+		self.line_properties = ScaleLineProperties
 
-	def gen_station_unique(self):
-		for i in range(50):
-			s = self.gen_station()
-			
-			if s not in self.station_gen_set:
-				self.station_gen_set.add(s)
-				return s
+	@property
+	def stations_per_line(self):
+		return max(2, gen_n(self.stats["stations_per_line"]))
 
-		raise Exception("Failed to generate unique station")
+	def gen_lines(self, n=None):
+		if n is None:
+			n = gen_n(self.stats["lines"])
 
-	def gen_lines(self):
-		self.line_set = set()
+		self.n_lines = n
 
-		n = gen_n(self.stats["lines"])
+	def gen_stations(self, n=1):
+		"""Place and coalesce the stations of n graphs, stacked in one Topology"""
 
-		while len(self.line_set) < n:
-			line = self.gen_line()
-			self.line_set.add(line)
+		with telemetry.timer("graph.stations"):
+			xs, ys = self.place_stations(n)
 
+		with telemetry.timer("graph.coalesce"):
+			self.skeleton = self.coalesce_stations(xs, ys, n)
 
-	def gen_stations(self):
+	def place_stations(self, n=1):
+		"""Lay each line's stations along a random cubic bezier curve, sampling every line of n graphs at once.
 
-		self.station_gen_set = set()
-		self.line_stations = {}
-		
-		for line in self.line_set:
+		Returns the station xs and ys, in order of graph, line then stop.
+		"""
 
-			xs = []
-			ys = []
-			
-			for i in range(4):
-				x = (random.random()*2-1) * self.stats["map_radius"]
-				y = (random.random()*2-1) * self.stats["map_radius"]
-				xs.append(x)
-				ys.append(y)
+		rng = np.random.default_rng(random.getrandbits(64))
+		r = self.stats["map_radius"]
 
-			curve = bezier.curve.Curve.from_nodes(np.array([xs,ys]))
+		# Control points (graph, line, xy, point) evaluated along the curve, then 5% noise
+		control = rng.uniform(-r, r, size=(n, self.n_lines, 2, 4))
+		pts = control @ bezier_basis(self.stations_per_line)
+		pts *= rng.uniform(0.95, 1.05, size=pts.shape)
 
-			# z = np.polyfit(xs, ys, 3)
-			# p = np.poly1d(z)
+		return pts[:, :, 0, :].ravel(), pts[:, :, 1, :].ravel()
 
-			pts = curve.evaluate_multi(np.linspace(0,1, max(2, gen_n(self.stats["stations_per_line"]))))
+	def coalesce_stations(self, xs, ys, n=1):
+		"""Collapse every cluster of stations closer than min_station_dist into its first station.
 
-			# xp = np.linspace(xs[0], xs[-1], gen_n(self.stats["stations_per_line"]))
-			# yp = p(xp)
+		Stations are linked when within min_station_dist of each other, and each
+		connected cluster is merged into the station that comes first in line order.
+		The result has no two stations within min_station_dist, as the repeated
+		nearby-station collapse this replaces did, but the lines are rewritten once.
 
-			stations = []
+		Takes the stations of n graphs as place_stations gives them, and returns
+		their Topology: each station still visited, in the order first visited,
+		and an edge between each pair of consecutive stops of a line.
+		"""
 
-			# for x, y in zip(xp, yp):
-			for [x,y] in np.transpose(pts):
-				s = self.gen_station_unique()
-				s.p["x"] = float(add_noise(x))
-				s.p["y"] = float(add_noise(y))
-				
-				stations.append(s)
+		per_line = self.stations_per_line
+		per_graph = self.n_lines * per_line
+		d = self.stats["min_station_dist"]
+		total = len(xs)
+		stop_line = np.arange(total) // per_line
 
-			self.line_stations[line] = stations
+		# Curves stay within their control points' hull, so graphs this far apart never meet
+		pitch = 2.2 * self.stats["map_radius"] + 2 * d
+		offset = np.repeat(np.arange(n) * pitch, per_graph)
+		pairs = nearby_pairs(np.stack([xs + offset, ys], axis=-1), d)
 
-		# Helpers for coalesce operation
-		def find_nearby_stations():
+		logger.debug(f"Coalesce stations: {len(pairs)} nearby pairs")
 
-			if len(self.station_set) == 0:
-				return frozenset()
+		if len(pairs) == 0:
+			nodes = stops = np.arange(total)
+			lines = stop_line
+		else:
+			root = union_find(total, pairs)
 
-			samples = []
-			features = []
+			# The first stop of each line at each (merged) station, in line order
+			_, first = np.unique(stop_line * total + root, return_index=True)
+			first.sort()
+			stops, lines = root[first], stop_line[first]
 
-			for i in self.station_set:
-				features.append(i)
-				samples.append(i.pt)
+			_, first = np.unique(stops, return_index=True)
+			nodes = stops[np.sort(first)]
 
-			X = np.array(samples)
-			tree = KDTree(X, 10)
-			ind = tree.query_radius(X, self.stats["min_station_dist"])
+		index = np.empty(total, dtype=np.int64)
+		index[nodes] = np.arange(len(nodes))
 
-			return frozenset([
-				frozenset([ features[i] for i in group ]) for group in ind if len(group) > 1
-			])
+		same = lines[:-1] == lines[1:]
+		src = index[stops[:-1][same]]
+		dst = index[stops[1:][same]]
+		edge_line = lines[:-1][same]
 
+		# Graphs never share a station, so each graph's stations and edges are a run
+		graphs = np.arange(n + 1)
+		node_start = np.searchsorted(nodes // per_graph, graphs)
+		edge_graph = edge_line // self.n_lines
+		edge_start = np.searchsorted(edge_graph, graphs)
 
-		def repif(cur, tar, rep):
-			if cur == tar:
-				return rep
-			else:
-				return cur
-
-		def remove_dupes(l):
-			return list(OrderedDict.fromkeys(l))
-
-		def replace_station(target, replacement):
-			self.line_stations = {
-				line: remove_dupes([repif(i, target, replacement) for i in stations])
-				for line, stations in self.line_stations.items()
-			}
-			
-		# Coalesce nearby stations on lines
-		# Coalesce stations between lines
-		logger.debug("Coalesce stations")
-		for i in range(30):
-			groups = find_nearby_stations()
-
-			if len(groups) == 0:
-				break
-
-			logger.debug(f"Found {len(groups)} groups of nearby stations")
-			for a, *rest in groups:
-				for b in rest:
-					replace_station(b, a)
-
+		return Topology(
+			xs[nodes], ys[nodes],
+			(src - node_start[edge_graph]).astype(np.int32),
+			(dst - node_start[edge_graph]).astype(np.int32),
+			(edge_line - edge_graph * self.n_lines).astype(np.int32),
+			node_start, graphs * self.n_lines, edge_start,
+		)
 
-	def gen_int_names(self):
-		for a_set in [self.line_set, self.station_set]:
-			int_names = list(range(len(a_set) * 2)) # allocate more names than stations so we can test for existence
-			random.shuffle(int_names)
-			for i, item in enumerate(a_set):
-				item.p["name"] = str(int_names[i])
-				item.p["id"] = item.p["name"]
-		
-		
+	def topology(self):
+		"""This graph's skeleton: where its stations are and the edges between them"""
+		return self.skeleton
 
-	def gen_graph_spec(self):
-		
-		nodes = {}
-		edges = []
-		lines = {}
+	def gen_names(self, topology, rng, line_codes):
+		"""Station and line names for every graph of topology, each distinct within its graph"""
+		if self.args.int_names:
+			return int_names(np.diff(topology.node_start), rng), int_names(np.diff(topology.line_start), rng)
+
+		# Only built (or loaded) by the first graph that needs it, so int_names runs never pay for it
+		pool = name_pool(self.args.name_pool)
+
+		node_names = []
+		words = []
+		for n_nodes, n_lines in zip(np.diff(topology.node_start).tolist(), np.diff(topology.line_start).tolist()):
+			node_names += pool.stations(n_nodes)
+			words += pool.lines(n_lines)
+
+		colors = decoded(line_codes["color"], self.line_properties["color"])
+		return node_names, [f"{c} {w}".title() for c, w in zip(colors, words)]
+
+	def gen_graph_specs(self, topology):
+		"""
+		A GraphSpec for each graph of topology, with new station and line properties,
+		names and ids. Everything is sampled for all the graphs at once and records
+		are built a column at a time.
+		"""
+
+		t = topology
+		n_nodes = len(t.xs)
+		n_lines = int(t.line_start[-1])
+
+		rng = np.random.default_rng(random.getrandbits(64))
+		node_codes = sample_codes(rng, StationProperties, n_nodes)
+		line_codes = sample_codes(rng, self.line_properties, n_lines)
+
+		with telemetry.timer("graph.names"):
+			node_names, line_names = self.gen_names(t, rng, line_codes)
+
+			# Every id in one draw. Int names are already distinct, so they are the ids
+			if self.args.int_names:
+				graph_ids = gen_ids(len(t))
+				node_ids, line_ids = node_names, line_names
+			else:
+				ids = gen_ids(len(t) + n_nodes + n_lines)
+				graph_ids = ids[:len(t)]
+				node_ids = ids[len(t):len(t) + n_nodes]
+				line_ids = ids[len(t) + n_nodes:]
+
+		with telemetry.timer("graph.spec"):
+			if self.args.compact_graphs:
+				specs = self.gen_compact_graph_specs(t, graph_ids, node_ids, node_names, node_codes, line_ids, line_names, line_codes)
+			else:
+				specs = self.gen_graph_spec_records(t, graph_ids, node_ids, node_names, node_codes, line_ids, line_names, line_codes)
+
+		self.assert_data_valid(node_names)
+		return specs
+
+	def gen_graph_spec_records(self, t, graph_ids, node_ids, node_names, node_codes, line_ids, line_names, line_codes):
+		"""GraphSpecs of NodeSpec, EdgeSpec and LineSpec records"""
+
+		node_columns = {k: decoded(c, StationProperties[k]) for k, c in node_codes.items()}
+		node_columns.update(id=node_ids, name=node_names, x=t.xs.tolist(), y=t.ys.tolist())
+		nodes = records(NodeSpec, node_columns)
+
+		line_columns = {k: decoded(c, self.line_properties[k]) for k, c in line_codes.items()}
+		line_columns.update(id=line_ids, name=line_names)
+		lines = records(LineSpec, line_columns)
+
+		# Edge ends and lines as indices into every graph's nodes and lines
+		per_graph = np.diff(t.edge_start)
+		src = (t.edge_src + np.repeat(t.node_start[:-1], per_graph)).tolist()
+		dst = (t.edge_dst + np.repeat(t.node_start[:-1], per_graph)).tolist()
+		edge_line = (t.edge_line + np.repeat(t.line_start[:-1], per_graph)).tolist()
+
+		edges = records(EdgeSpec, {
+			"station1": [node_ids[i] for i in src],
+			"station1_name": [node_names[i] for i in src],
+			"station2": [node_ids[i] for i in dst],
+			"station2_name": [node_names[i] for i in dst],
+			"line_id": [line_ids[i] for i in edge_line],
+			"line_name": [line_names[i] for i in edge_line],
+			"line_color": [line_columns["color"][i] for i in edge_line],
+			"line_stroke": [line_columns["stroke"][i] for i in edge_line],
+		})
 
-		for line in self.line_set:
-			lines[line.p["id"]] = LineSpec(line.p)
+		node_start = t.node_start.tolist()
+		line_start = t.line_start.tolist()
+		edge_start = t.edge_start.tolist()
+
+		return [
+			GraphSpec(
+				dict(zip(node_ids[node_start[i]:node_start[i+1]], nodes[node_start[i]:node_start[i+1]])),
+				edges[edge_start[i]:edge_start[i+1]],
+				dict(zip(line_ids[line_start[i]:line_start[i+1]], lines[line_start[i]:line_start[i+1]])),
+				id=graph_ids[i],
+			)
+			for i in range(len(t))
+		]
+
+	def gen_compact_graph_specs(self, t, graph_ids, node_ids, node_names, node_codes, line_ids, line_names, line_codes):
+		"""CompactGraphSpecs, each a slice of the arrays"""
+
+		node_start = t.node_start.tolist()
+		line_start = t.line_start.tolist()
+		edge_start = t.edge_start.tolist()
+
+		specs = []
+		for i in range(len(t)):
+			n0, n1 = node_start[i], node_start[i+1]
+			l0, l1 = line_start[i], line_start[i+1]
+			e0, e1 = edge_start[i], edge_start[i+1]
+
+			specs.append(CompactGraphSpec(
+				node_ids=node_ids[n0:n1],
+				node_names=node_names[n0:n1],
+				xs=t.xs[n0:n1],
+				ys=t.ys[n0:n1],
+				node_codes={k: c[n0:n1] for k, c in node_codes.items()},
+				node_categories=StationProperties,
+				line_ids=line_ids[l0:l1],
+				line_names=line_names[l0:l1],
+				line_codes={k: c[l0:l1] for k, c in line_codes.items()},
+				line_categories=self.line_properties,
+				edge_src=t.edge_src[e0:e1],
+				edge_dst=t.edge_dst[e0:e1],
+				edge_line=t.edge_line[e0:e1],
+				id=graph_ids[i],
+			))
+
+		return specs
+
+	def assert_data_valid(self, station_names):
+		if self.args.int_names:
+			for name in station_names:
+				int(name)
 
-		for line, stations in self.line_stations.items():
-			for idx, i in enumerate(stations):
-				nodes[i.p["id"]] = NodeSpec(i.p)
 
-				if idx+1 < len(stations):
+	def generate_batch(self, n, topologies=None):
+		"""
+		Generate n graphs together, which is much faster than one at a time for small graphs.
 
-					a = {
-						"station1": i.p["id"],
-						"station1_name": i.p["name"],
-						"station2": stations[idx+1].p["id"],
-						"station2_name": stations[idx+1].p["name"],
-					}
+		Every graph's stations are placed and coalesced in one stacked set of arrays,
+		then their properties, names and ids are sampled all at once too. Given a
+		list of n topologies (see TopologyPool), just resamples their properties.
+		Returns a finished GraphGenerator for each graph, as generate() would.
+		"""
 
-					b = line.to_attr_dict()
+		if topologies is not None:
+			self.skeleton = Topology.stack(topologies)
 
-					edges.append(EdgeSpec({**a, **b}))
+		else:
+			with telemetry.timer("graph.lines"):
+				self.gen_lines()
 
+			self.gen_stations(n)
 
-		self.graph_spec = GraphSpec(
-			nodes, edges, lines
-		)
+		graphs = []
+		for i, spec in enumerate(self.gen_graph_specs(self.skeleton)):
+			g = copy.copy(self)
+			g.skeleton = topologies[i] if topologies is not None else self.skeleton.graph(i)
+			g.graph_spec = spec
+			graphs.append(g)
 
-	def assert_data_valid(self):
-		if self.args.int_names:
-			for stations in self.line_stations.values():
-				for s in stations:
-					int(s.p["name"])
+		return graphs
 
+	def generate(self, topology=None):
+		"""Generate a graph, or with a topology (see TopologyPool) just resample its properties"""
 
-	def generate(self):
+		if topology is not None:
+			self.skeleton = topology
 
-		self.gen_lines()
-		logger.debug("Generated lines")
-		self.gen_stations()
+		else:
+			with telemetry.timer("graph.lines"):
+				self.gen_lines()
+			logger.debug("Generated lines")
+			self.gen_stations()
 
-		if self.args.int_names:
-			self.gen_int_names()
-			logger.debug("Generated int names")
+		return self.finish()
 
-		self.gen_graph_spec()
+	def finish(self):
+		"""Properties, names, ids and the GraphSpec, once the stations are in place"""
 
-		self.assert_data_valid()
+		self.graph_spec, = self.gen_graph_specs(self.skeleton)
 
 		# For chaining
 		return self
@@ -312,43 +530,38 @@ class GraphGenerator(object):
 	
 	
 
-	def draw(self, filename="./graph.png"):
-
-		try:
-			import matplotlib
-			matplotlib.use("Agg") # Work in terminal
-			from matplotlib import pyplot as plt
-		except:
-			pass
-
-		fig, ax = plt.subplots(figsize=(30, 30))
-
-		lines_per_station = Counter()
-		for line, stations in self.line_stations.items():
-			for station in stations:
-				lines_per_station[station] += 1
+	def draw(self, filename="./graph.png", **kwargs):
+		"""Draw this graph to filename (see gqa.render for the options)"""
+		render(drawing(self.graph_spec), filename, **kwargs)
 
 
-		for line, stations in self.line_stations.items():
-			xs = [i.p["x"] for i in stations]
-			ys = [i.p["y"] for i in stations]
-			ts = [i.p["name"] for i in stations]
-			ls = line.p["stroke"]
-			c = 'tab:'+line.p["color"]
-			ax.plot(xs, ys, color=c, marker='.', ls=ls, lw=4, markersize=16)
+class TopologyPool(object):
+	"""
+	Graph topologies built once, so that new graphs can be made by resampling
+	properties, names and ids on one of them, skipping the geometry.
 
-			inter_xs = [i.p["x"] for i in stations if lines_per_station[i] > 1]
-			inter_ys = [i.p["y"] for i in stations if lines_per_station[i] > 1]
-			ax.plot(inter_xs, inter_ys, color='grey', marker='s', ls='', markersize=10)
-
-			for i in stations:
-				ax.annotate(i.p["name"], i.pt)
-
-
-
-		with open(filename, 'wb') as file:
-			plt.savefig(file) 
+	The pool is built from its own seed, with the `random` state put back after,
+	so a run (or a resumed run) given the same seed gets the same topologies.
+	"""
 
+	def __init__(self, args, size, seed):
+		state = random.getstate()
+		try:
+			random.seed(seed)
+			g = GraphGenerator(args)
+			g.gen_lines()
+			g.gen_stations(size)
+			self.topologies = [g.skeleton.graph(i) for i in range(size)]
+		finally:
+			random.setstate(state)
+
+	def generate(self, args):
+		"""A new graph on a randomly chosen topology"""
+		return GraphGenerator(args).generate(topology=random.choice(self.topologies))
+
+	def generate_batch(self, args, n):
+		"""n new graphs, each on a randomly chosen topology, made together (see GraphGenerator.generate_batch)"""
+		return GraphGenerator(args).generate_batch(n, topologies=random.choices(self.topologies, k=n))
 
 if __name__ == "__main__":
 
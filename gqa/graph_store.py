@@ -0,0 +1,115 @@
+
+import os
+import os.path
+import json
+from collections import OrderedDict
+
+from .types import GraphSpec
+from .writer import plain
+
+# --------------------------------------------------------------------------
+# Graph store: each graph written once, looked up by id
+#
+# Graphs are JSON lines in {dataset}.graphs.jsonl, with an index of
+# {id: [offset, length]} in {dataset}.graphs.index.json so any one graph
+# can be read without scanning the store
+# --------------------------------------------------------------------------
+
+def copy_graph(graph):
+	"""A copy of a plain graph dict and each of its node, edge and line dicts (whose values are plain)"""
+	return {k: [dict(i) for i in v] if isinstance(v, list) else v for k, v in graph.items()}
+
+
+def graph_store_filename(dataset_filename):
+	return os.path.splitext(dataset_filename)[0] + ".graphs.jsonl"
+
+def index_filename(store_filename):
+	return os.path.splitext(store_filename)[0] + ".index.json"
+
+
+class GraphStoreWriter(object):
+
+	def __init__(self, filename, resume=False):
+		self.filename = filename
+		self.offset = 0
+		self.index = {}
+
+		if resume:
+			# Carry on after the graphs already in the store
+			with open(filename, "rb") as file:
+				for line in file:
+					self.index[json.loads(line)["id"]] = [self.offset, len(line)]
+					self.offset += len(line)
+
+		self.file = open(filename, "ab" if resume else "wb")
+
+	def add(self, graph:GraphSpec):
+		"""Write graph, unless a graph with its id has already been written"""
+		if graph.id in self.index:
+			return
+
+		data = json.dumps(graph, default=plain).encode("utf-8") + b"\n"
+		self.file.write(data)
+		self.index[graph.id] = [self.offset, len(data)]
+		self.offset += len(data)
+
+	def flush(self):
+		self.file.flush()
+		os.fsync(self.file.fileno())
+
+	def close(self):
+		self.file.close()
+		with open(index_filename(self.filename), "w") as file:
+			json.dump(self.index, file)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+class GraphStore(object):
+	"""
+	Reads graphs by id on demand, keeping the most recently used cache_size of them.
+	Each lookup returns its own copy of the graph, so callers can change it freely.
+	"""
+
+	def __init__(self, filename, cache_size=16):
+		self.file = open(filename, "rb")
+		with open(index_filename(filename), "r") as file:
+			self.index = json.load(file)
+
+		self.cache = OrderedDict()
+		self.cache_size = cache_size
+
+	def __len__(self):
+		return len(self.index)
+
+	def __contains__(self, id):
+		return id in self.index
+
+	def __getitem__(self, id):
+		if id in self.cache:
+			self.cache.move_to_end(id)
+			return copy_graph(self.cache[id])
+
+		offset, length = self.index[id]
+		self.file.seek(offset)
+		graph = json.loads(self.file.read(length))
+
+		self.cache[id] = graph
+		if len(self.cache) > self.cache_size:
+			self.cache.popitem(last=False)
+
+		return copy_graph(graph)
+
+	def close(self):
+		self.file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
@@ -0,0 +1,180 @@
+
+import os
+import os.path
+import sys
+import json
+import struct
+import yaml
+import numpy as np
+
+from .reader import Loader, dataset_format, document_offsets, open_graph_store
+from .writer import import_optional
+
+# --------------------------------------------------------------------------
+# Byte offset index for random access into a dataset
+#
+# {dataset}.offsets holds an (offset, length) pair of little endian uint64s
+# for each document, in order. It is memory mapped when read, so the N-th
+# document is one read of its bytes however big the dataset is. The index is
+# written as documents are generated (--index) or built for an existing file
+# with python -m gqa.index data/gqa-xxxxxx.yaml ...
+#
+# Parquet has no index, as its rows are not each a run of bytes of their own
+# --------------------------------------------------------------------------
+
+RECORD = struct.Struct("<QQ")
+
+def offsets_filename(dataset_filename):
+	return os.path.splitext(dataset_filename)[0] + ".offsets"
+
+
+class DocumentIndexWriter(object):
+
+	def __init__(self, filename, resume=None):
+		"""Write a new index, or with resume the number of documents of the existing one to keep"""
+		self.filename = filename
+		self.buffer = bytearray()
+
+		if resume is not None:
+			os.truncate(filename, resume * RECORD.size)
+			self.file = open(filename, "ab")
+		else:
+			self.file = open(filename, "wb")
+
+	def add(self, offset, length):
+		self.buffer += RECORD.pack(offset, length)
+
+	def flush(self):
+		self.file.write(self.buffer)
+		self.buffer = bytearray()
+		self.file.flush()
+		os.fsync(self.file.fileno())
+
+	def close(self):
+		self.file.write(self.buffer)
+		self.file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+def scan_offsets(filename, format):
+	"""Byte offset of each document of an existing dataset, and of its end"""
+	if format == "yaml":
+		return document_offsets(filename) + [os.path.getsize(filename)]
+
+	offsets = [0]
+	if format == "jsonl":
+		with open(filename, "rb") as file:
+			for line in file:
+				offsets.append(offsets[-1] + len(line))
+
+	elif format == "msgpack":
+		msgpack = import_optional("msgpack")
+		with open(filename, "rb") as file:
+			unpacker = msgpack.Unpacker(file, raw=False)
+			for doc in unpacker:
+				offsets.append(unpacker.tell())
+
+	else:
+		raise ValueError(f"Cannot index {format} datasets")
+
+	return offsets
+
+
+def index_dataset(filename, format=None):
+	"""Build the offsets index of an existing dataset, returning how many documents it has"""
+	offsets = scan_offsets(filename, dataset_format(filename, format))
+
+	with DocumentIndexWriter(offsets_filename(filename)) as index:
+		for start, end in zip(offsets[:-1], offsets[1:]):
+			index.add(start, end - start)
+
+	return len(offsets) - 1
+
+
+def load_msgpack(data):
+	msgpack = import_optional("msgpack")
+	return msgpack.unpackb(data, raw=False)
+
+loaders = {
+	"yaml": lambda data: yaml.load(data, Loader=Loader),
+	"jsonl": json.loads,
+	"msgpack": load_msgpack,
+}
+
+
+class IndexedDataset(object):
+	"""
+	Random access to the documents of a dataset with an offsets index, as the same
+	dicts read_documents gives. Supports len(), integer indices and slices.
+
+	Only the pages of the index that are used are ever read, and documents are read
+	with os.pread, so forked workers (e.g. of a training data loader) can share one
+	IndexedDataset without sharing a file position. Graph references are resolved
+	from a graph store next to the dataset unless resolve_graphs is False.
+	"""
+
+	def __init__(self, filename, format=None, resolve_graphs=True):
+		self.filename = filename
+		format = dataset_format(filename, format)
+		self.load = loaders.get(format)
+		if self.load is None:
+			raise ValueError(f"Cannot index {format} datasets")
+
+		index = offsets_filename(filename)
+		if os.path.getsize(index) > 0:
+			self.index = np.memmap(index, dtype="<u8", mode="r").reshape(-1, 2)
+		else:
+			self.index = np.zeros((0, 2), dtype="<u8")
+
+		self.fd = os.open(filename, os.O_RDONLY)
+
+		self.store = open_graph_store(filename) if resolve_graphs else None
+
+	def __len__(self):
+		return len(self.index)
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return [self[j] for j in range(*i.indices(len(self)))]
+
+		offset, length = self.index[i]
+		doc = self.load(os.pread(self.fd, int(length), int(offset)))
+
+		graph = doc["graph"]
+		if self.store is not None and graph is not None and len(graph) == 1 and "id" in graph:
+			doc["graph"] = self.store[graph["id"]]
+		return doc
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self[i]
+
+	def shuffled(self, seed=None):
+		"""Every document once, in a random order, e.g. for one epoch of training"""
+		for i in np.random.default_rng(seed).permutation(len(self)):
+			yield self[i]
+
+	def close(self):
+		os.close(self.fd)
+		if self.store is not None:
+			self.store.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+
+if __name__ == "__main__":
+
+	# Index existing datasets
+	for filename in sys.argv[1:]:
+		n = index_dataset(filename)
+		print(f"{filename}: {n} docs indexed in {offsets_filename(filename)}")
@@ -0,0 +1,147 @@
+
+import os
+import os.path
+import json
+import random
+import gibberish
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------
+# Name pools for stations and lines
+#
+# Generating a unique gibberish name per station is slow and can fail on big
+# graphs, so each process builds large deduplicated pools once and every
+# graph draws its names from them without replacement.
+#
+# Pools are built from a fixed seed, so every process (and every shard) has
+# the same pools and seeded runs stay reproducible. Which names a graph gets
+# is drawn from the `random` module as before. Pass --name-pool FILE to save
+# the pools on first use and load them on later runs
+# --------------------------------------------------------------------------
+
+POOL_SEED = 0xC1E6
+POOL_VERSION = 1
+
+SURNAMES = [" street", " st", " road", " court", " grove", "bridge", " bridge", " lane", " way", " boulevard", " crossing", " square", "ham", ' on trent', ' upon Thames', ' international', ' hospital', 'neyland', 'ington', 'ton', 'wich', ' manor', ' estate', ' palace']
+
+
+def unique_words(n, make, max_attempts_per_word=20):
+	"""Up to n distinct results of make(), in the order first made"""
+	words = {}
+	for _ in range(n * max_attempts_per_word):
+		if len(words) == n:
+			break
+		words.setdefault(make(), None)
+
+	if len(words) < n:
+		logger.warning(f"Only found {len(words)} of {n} unique names")
+
+	return list(words)
+
+
+def gen_station_name():
+	return (gibberish.generate_word() + random.choice(SURNAMES)).title()
+
+
+class NamePool(object):
+
+	def __init__(self, stations, lines):
+		self.station_names = stations
+		self.line_words = lines
+
+	@classmethod
+	def build(cls, n_stations=50000, n_lines=5000):
+		# gibberish draws from the `random` module, so seed it for the pool and put it back after
+		state = random.getstate()
+		try:
+			random.seed(POOL_SEED)
+			stations = unique_words(n_stations, gen_station_name)
+			lines = unique_words(n_lines, gibberish.generate_word)
+		finally:
+			random.setstate(state)
+
+		return cls(stations, lines)
+
+	@classmethod
+	def load(cls, filename):
+		with open(filename, "r") as file:
+			data = json.load(file)
+
+		if data.get("version") != POOL_VERSION:
+			raise ValueError(f"{filename} is not a version {POOL_VERSION} name pool")
+
+		return cls(data["stations"], data["lines"])
+
+	def save(self, filename):
+		# Write then rename, as sharded workers may all save the same pool at once
+		tmp = f"{filename}.{os.getpid()}.tmp"
+		with open(tmp, "w") as file:
+			json.dump({
+				"version": POOL_VERSION,
+				"stations": self.station_names,
+				"lines": self.line_words,
+			}, file)
+		os.replace(tmp, filename)
+
+	def stations(self, n):
+		"""n distinct station names"""
+		return draw(self.station_names, n)
+
+	def lines(self, n):
+		"""n distinct words to name lines with"""
+		return draw(self.line_words, n)
+
+
+def draw(pool, n):
+	"""n distinct names from pool, drawn without replacement.
+
+	If n is larger than the pool, repeats of the pool are told apart with a
+	number (e.g. "Foo Street 2") so the names are still distinct.
+	"""
+	size = len(pool)
+	copies = -(-n // size)
+	picks = random.sample(range(size * copies), n)
+
+	return [
+		pool[i % size] if i < size else f"{pool[i % size]} {i // size + 1}"
+		for i in picks
+	]
+
+
+def int_names(counts, rng):
+	"""
+	For each n of counts, n distinct integer names from twice as many, so absent names
+	can be asked about. Drawn all at once from the numpy Generator rng and returned as
+	one list, each count's names in turn.
+	"""
+	counts = np.asarray(counts, dtype=np.int64)
+	group = np.repeat(np.arange(len(counts)), 2 * counts)
+	start = np.cumsum(2 * counts) - 2 * counts
+
+	# A random order of each count's range(2n), of which the first n are its names
+	order = np.lexsort((rng.random(len(group)), group))
+	position = np.arange(len(group)) - start[group]
+	names = (order - start[group])[position < counts[group]]
+
+	return [str(i) for i in names.tolist()]
+
+
+_pools = {}
+
+def name_pool(filename=None):
+	"""The process-wide NamePool, loaded from (or saved to) filename if given"""
+	if filename not in _pools:
+		if filename is not None and os.path.exists(filename):
+			pool = NamePool.load(filename)
+		else:
+			pool = NamePool.build()
+			if filename is not None:
+				pool.save(filename)
+				logger.info(f"Saved name pool to {filename}")
+
+		_pools[filename] = pool
+
+	return _pools[filename]
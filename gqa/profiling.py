@@ -0,0 +1,201 @@
+
+import os
+import os.path
+import sys
+import time
+import signal
+import pstats
+import cProfile
+import threading
+from collections import Counter
+
+from .telemetry import NULL_TIMER
+
+# --------------------------------------------------------------------------
+# Opt-in profiling of generation runs
+#
+# Either cProfile (written as pstats) or a sampling profiler that records the
+# stack every interval of CPU time (written as collapsed stacks, one
+# "root;...;leaf count" per line, as flamegraph.pl and speedscope read).
+# Profiling covers the whole run, or only the named phases:
+#   graph      GraphGenerator.generate
+#   form       QuestionForm.generate
+#   serialize  writing documents out
+# --------------------------------------------------------------------------
+
+PHASES = ["graph", "form", "serialize"]
+
+EXTENSIONS = {
+	"cprofile": ".prof",
+	"sample": ".collapsed",
+}
+
+
+def collapse(frame):
+	stack = []
+	while frame is not None:
+		code = frame.f_code
+		stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+		frame = frame.f_back
+	return ";".join(reversed(stack))
+
+
+class StackSampler(object):
+	"""
+	Counts the stacks of the thread that made it, sampled every interval seconds of CPU
+	time while enabled. Uses a profiling timer signal where there is one, which needs
+	the main thread, and otherwise a background thread sampling every interval of wall time.
+	"""
+
+	def __init__(self, interval=0.005):
+		self.interval = interval
+		self.thread_id = threading.get_ident()
+		self.stacks = Counter()
+		self.active = False
+		self.thread = None
+
+		if hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread():
+			self.previous_handler = signal.signal(signal.SIGPROF, self.on_signal)
+			signal.setitimer(signal.ITIMER_PROF, interval, interval)
+		else:
+			self.running = True
+			self.thread = threading.Thread(target=self.run, daemon=True)
+			self.thread.start()
+
+	def on_signal(self, signum, frame):
+		if self.active:
+			self.stacks[collapse(frame)] += 1
+
+	def run(self):
+		while self.running:
+			time.sleep(self.interval)
+			if self.active:
+				frame = sys._current_frames().get(self.thread_id)
+				if frame is not None:
+					self.stacks[collapse(frame)] += 1
+
+	def enable(self):
+		self.active = True
+
+	def disable(self):
+		self.active = False
+
+	def stop(self):
+		if self.thread is None:
+			signal.setitimer(signal.ITIMER_PROF, 0)
+			signal.signal(signal.SIGPROF, self.previous_handler)
+		else:
+			self.running = False
+			self.thread.join()
+
+	def dump_stats(self, filename):
+		write_collapsed(filename, self.stacks)
+
+
+def read_collapsed(filename):
+	stacks = Counter()
+	with open(filename, "r") as file:
+		for line in file:
+			stack, count = line.rstrip("\n").rsplit(" ", 1)
+			stacks[stack] += int(count)
+	return stacks
+
+def write_collapsed(filename, stacks):
+	with open(filename, "w") as file:
+		for stack, count in stacks.most_common():
+			file.write(f"{stack} {count}\n")
+
+
+def merge_profiles(filenames, output, mode):
+	"""Combine the per-worker profiles of a sharded run into one"""
+	filenames = [i for i in filenames if os.path.exists(i)]
+	if len(filenames) == 0:
+		return
+
+	if mode == "cprofile":
+		pstats.Stats(*filenames).dump_stats(output)
+	else:
+		stacks = Counter()
+		for i in filenames:
+			stacks.update(read_collapsed(i))
+		write_collapsed(output, stacks)
+
+
+def profile_filename(dataset_filename, mode):
+	return os.path.splitext(dataset_filename)[0] + EXTENSIONS[mode]
+
+
+class Phase(object):
+	def __init__(self, profiler):
+		self.profiler = profiler
+
+	def __enter__(self):
+		self.profiler.enter()
+		return self
+
+	def __exit__(self, *exc):
+		self.profiler.exit()
+
+
+class Profiler(object):
+	"""
+	Profiles the phases it is started with. Code marks its phases with
+	`with profiler.phase(name)`, which does nothing unless that phase is being profiled.
+	"""
+
+	def __init__(self):
+		self.mode = None
+		self.profile = None
+
+	def start(self, mode, phases=None, interval=0.005):
+		"""Begin profiling: every phase if phases is None"""
+		self.mode = mode
+		self.phases = set(phases) if phases is not None else None
+		self.depth = 0
+
+		if mode == "cprofile":
+			self.profile = cProfile.Profile()
+		elif mode == "sample":
+			self.profile = StackSampler(interval)
+		else:
+			raise ValueError(f"Unknown profiler {mode}")
+
+		if self.phases is None:
+			self.profile.enable()
+
+	def phase(self, name):
+		if self.mode is None or self.phases is None or name not in self.phases:
+			return NULL_TIMER
+		return Phase(self)
+
+	def enter(self):
+		if self.depth == 0:
+			self.profile.enable()
+		self.depth += 1
+
+	def exit(self):
+		self.depth -= 1
+		if self.depth == 0:
+			self.profile.disable()
+
+	def stop(self, filename):
+		"""Stop profiling and write the results to filename"""
+		self.profile.disable()
+		if self.mode == "sample":
+			self.profile.stop()
+
+		self.profile.dump_stats(filename)
+		self.mode = None
+		self.profile = None
+
+
+# The process-wide instance that generation code marks its phases on
+profiler = Profiler()
+
+
+if __name__ == "__main__":
+
+	# python -m gqa.profiling merged.prof shard-0000.prof shard-0001.prof ...
+	output, *inputs = sys.argv[1:]
+	mode = "cprofile" if output.endswith(EXTENSIONS["cprofile"]) else "sample"
+	merge_profiles(inputs, output, mode)
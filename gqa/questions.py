@@ -3,9 +3,13 @@ import logging
 logger = logging.getLogger(__name__)
 
 import traceback
+import random
+from collections import Counter
 
 from .functional import *
 from .types import QuestionSpec
+from .context import GraphContext
+from .telemetry import telemetry
 from networkx.exception import NetworkXNoPath
 
 from gql import GqlBuilder
@@ -15,13 +19,26 @@ from gql import GqlBuilder
 # --------------------------------------------------------------------------
 
 
+class NoValidArguments(ValueError):
+	"""The form's candidates function found no arguments that work on this graph"""
+	pass
+
 
 class QuestionForm(object):
+	"""
+	A type of question. Arguments for the placeholders are sampled independently with
+	each placeholder's get(), unless candidates is given. That is a function of the
+	GraphContext listing every binding (tuple of raw placeholder arguments) that will
+	give a valid question, and one of those is drawn instead. The list is computed once
+	per graph.
+	"""
+
 	def __init__(self, placeholders, english:str, functional:FunctionalOperator, type_string:str, 
 		arguments_valid=(lambda *args:True), 
 		answer_valid=(lambda *args:True),
 		group:str=None,
 		type_id:int=None, 
+		candidates=None,
 	):
 
 		self.placeholders = placeholders
@@ -32,6 +49,8 @@ class QuestionForm(object):
 		self.arguments_valid = arguments_valid
 		self.answer_valid = answer_valid
 		self.group = group
+		self.candidates = candidates
+		self.template = None
 
 	def __repr__(self):
 		return self.english
@@ -41,8 +60,32 @@ class QuestionForm(object):
 			*[f"{{{i.__name__}}}" for i in self.placeholders]
 		)
 
-	def generate(self, graph, runtime_args):		
-		args = [i.get(graph) for i in self.placeholders]
+	def sample_arguments(self, graph:GraphContext):
+		"""Placeholder instances for one attempt at this form on graph"""
+		if self.candidates is not None:
+			bindings = graph.memo(self.candidates, self.candidates)
+			if len(bindings) == 0:
+				raise NoValidArguments(f"No valid arguments for {self.type_string} on this graph")
+			return [p(i) for p, i in zip(self.placeholders, random.choice(bindings))]
+		else:
+			return [i.get(graph) for i in self.placeholders]
+
+	def stripped_functional(self, args):
+		"""
+		The stripped program for these placeholder instances. The program is stripped
+		once per form with Slots for arguments, and each question only fills them in.
+		"""
+		if self.template is None:
+			self.template = self.functional(*[Slot(i) for i in range(len(self.placeholders))]).stripped()
+		return fill(self.template, args)
+
+	def generate(self, graph, runtime_args):
+		if not isinstance(graph, GraphContext):
+			graph = GraphContext(graph)
+
+		with telemetry.timer("question.arguments", self.type_string):
+			args = self.sample_arguments(graph)
+
 		raw_args = [i.args[0] for i in args]
 
 		def englishify(s):
@@ -54,16 +97,20 @@ class QuestionForm(object):
 		english_args = [englishify(i) for i in raw_args]
 
 		english = self.english.format(*english_args)
-		answer = self.functional(*raw_args)(graph)
-		functional = self.functional(*args).stripped()
+		with telemetry.timer("question.program", self.type_string):
+			answer = self.functional(*raw_args)(graph)
+
+		with telemetry.timer("question.stripped", self.type_string):
+			functional = self.stripped_functional(args)
 
 		if runtime_args.generate_cypher:
-			try:
-				cypher = GqlBuilder(functional).build()
-			except Exception as ex:
-				logger.debug(f"Failed to generate cypher: {ex}")
-				# traceback.print_exc()
-				cypher = None
+			with telemetry.timer("question.cypher", self.type_string):
+				try:
+					cypher = GqlBuilder(functional).build()
+				except Exception as ex:
+					logger.debug(f"Failed to generate cypher: {ex}")
+					# traceback.print_exc()
+					cypher = None
 		else:
 			cypher = None
 
@@ -75,6 +122,41 @@ class QuestionForm(object):
 
 	
 
+# --------------------------------------------------------------------------
+# Candidate bindings for forms that rarely succeed with independent sampling
+# --------------------------------------------------------------------------
+
+def station_pairs_with_common_neighbor(graph:GraphContext):
+	pairs = {}
+	for m in graph.node_list:
+		ns = graph.neighbors(m["id"])
+		for a in ns:
+			for b in ns:
+				if a is not b:
+					pairs[(a["id"], b["id"])] = (a, b)
+	return list(pairs.values())
+
+def architecture_unique_among_neighbors(graph:GraphContext):
+	bindings = []
+	for s in graph.node_list:
+		c = Counter(n["architecture"] for n in graph.neighbors(s["id"]))
+		for a in StationProperties["architecture"]:
+			if c[a] == 1:
+				bindings.append((a, s))
+	return bindings
+
+def architecture_reachable_from_station(graph:GraphContext):
+	reachable = {}
+	for n in graph.node_list:
+		reachable.setdefault(graph.component(n["id"]), set()).add(n["architecture"])
+
+	return [
+		(x, a)
+		for x in graph.node_list
+		for a in StationProperties["architecture"]
+		if a in reachable[graph.component(x["id"])]
+	]
+
 
 question_forms = [
 
@@ -283,7 +365,8 @@ question_forms = [
 			lambda y: Count(ShortestPath(x, y, []))
 		), "name"),
 		"NearestStationArchitecture",
-		group="MultiStep"),
+		group="MultiStep",
+		candidates=architecture_reachable_from_station),
 
 	QuestionForm(
 		[Station, Station],
@@ -315,13 +398,15 @@ question_forms = [
 		lambda a,b: UnpackUnitList(Pluck(Sample(Intersection(Neighbors(a), Neighbors(b)), 1), "name")),
 		"StationPairAdjacent",
 		arguments_valid=lambda g, a, b: a != b,
-		answer_valid=lambda g, a, b, c: a != b and a != c),
+		answer_valid=lambda g, a, b, c: a != b and a != c,
+		candidates=station_pairs_with_common_neighbor),
 
 	QuestionForm(
 		[Architecture, Station], 
 		"Which {} station is adjacent to {}?", 
 		lambda a,b: UnpackUnitList(Pluck(Filter(Neighbors(b), "architecture", a), "name")),
-		"StationArchitectureAdjacent"),
+		"StationArchitectureAdjacent",
+		candidates=architecture_unique_among_neighbors),
 
 	QuestionForm(
 		[Station, Station], 
@@ -0,0 +1,246 @@
+
+import os.path
+import sys
+import json
+import time
+import mmap
+import yaml
+import multiprocessing
+
+from .graph_store import GraphStore, graph_store_filename, copy_graph
+from .binary_store import BinaryGraphStore, binary_store_filename
+from .types import DocumentSpec, GraphSpec, GraphRef, QuestionSpec, NodeSpec, EdgeSpec, LineSpec
+from .writer import import_optional
+
+# Our documents are plain data, so the (C) safe loader reads them
+try:
+	from yaml import CSafeLoader as Loader
+except ImportError:
+	from yaml import SafeLoader as Loader
+
+# --------------------------------------------------------------------------
+# Readers matching each writer in gqa.writer
+#
+# Every reader yields documents as the same plain dicts that loading the
+# YAML output gives, whatever format they were written in
+# --------------------------------------------------------------------------
+
+def read_yaml(filename):
+	with open(filename, "r") as file:
+		for doc in yaml.load_all(file, Loader=Loader):
+			yield doc
+
+def read_jsonl(filename):
+	with open(filename, "r") as file:
+		for line in file:
+			yield json.loads(line)
+
+def read_msgpack(filename):
+	msgpack = import_optional("msgpack")
+	with open(filename, "rb") as file:
+		for doc in msgpack.Unpacker(file, raw=False):
+			yield doc
+
+def read_parquet(filename):
+	pq = import_optional("pyarrow.parquet")
+
+	graph_id = None
+	graph = None
+
+	for batch in pq.ParquetFile(filename).iter_batches():
+		for row in batch.to_pylist():
+
+			# Graphs are only stored on the first row that uses them
+			if row["graph"] is not None:
+				graph = json.loads(row["graph"])
+				graph_id = row["graph_id"]
+
+			if row["graph_id"] is None:
+				doc_graph = None
+			elif row["graph_id"] == graph_id:
+				# Each row its own copy, so changing one document's graph leaves the others be
+				doc_graph = copy_graph(graph)
+			else:
+				# Reference into a separate graph store
+				doc_graph = {"id": row["graph_id"]}
+
+			yield {
+				"answer": json.loads(row["answer"]),
+				"graph": doc_graph,
+				"question": {
+					"english": row["english"],
+					"functional": json.loads(row["functional"]),
+					"type_string": row["type_string"],
+					"type_id": row["type_id"],
+					"cypher": row["cypher"],
+					"group": row["group"],
+					"type": {
+						"id": row["type_id"],
+						"name": row["type_string"],
+					}
+				}
+			}
+
+
+# --------------------------------------------------------------------------
+# Parallel YAML reading
+#
+# YAMLWriter starts every document with '---' at the start of a line, and
+# nothing inside a document does (everything below the top level keys is
+# indented), so one scan of the bytes finds where each document starts.
+# Runs of whole documents are then parsed by a pool of processes
+# --------------------------------------------------------------------------
+
+def document_offsets(filename):
+	"""Byte offset of the start of each YAML document in filename"""
+	offsets = []
+	with open(filename, "rb") as file:
+		if os.fstat(file.fileno()).st_size == 0:
+			return offsets
+
+		with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as m:
+			i = 0 if m[:3] == b"---" else m.find(b"\n---")
+			while i >= 0:
+				start = i if m[i:i+3] == b"---" else i + 1
+				# '---' followed by anything but a space or newline is just text
+				if m[start+3:start+4] in (b"", b" ", b"\n", b"\r"):
+					offsets.append(start)
+				i = m.find(b"\n---", start + 3)
+
+	return offsets
+
+
+def document_ranges(offsets, size, chunk_bytes):
+	"""(start, end) byte ranges of consecutive whole documents, each at least chunk_bytes long (bar the last)"""
+	ranges = []
+	start = None
+	for offset in offsets + [size]:
+		if start is None:
+			start = offset
+		elif offset - start >= chunk_bytes or offset == size:
+			ranges.append((start, offset))
+			start = offset
+	return ranges
+
+
+def load_range(task):
+	"""Pool worker: parse the documents in one byte range of a file, as DocumentSpecs if specs"""
+	filename, start, end, specs = task
+	with open(filename, "rb") as file:
+		file.seek(start)
+		data = file.read(end - start)
+	docs = yaml.load_all(data, Loader=Loader)
+	return [spec(doc) for doc in docs] if specs else list(docs)
+
+
+def read_yaml_parallel(filename, workers=None, ordered=True, specs=False, chunk_bytes=1<<23):
+	"""
+	Yield each document of a YAML dataset, parsed by a pool of `workers` processes
+	(by default one per core) in ranges of about chunk_bytes.
+
+	With ordered False, runs of documents come in whichever order they finish
+	parsing. With specs, the workers also rebuild documents as DocumentSpec (see
+	spec()), which costs less to unpickle here than the plain dicts and spec() together.
+	"""
+	ranges = document_ranges(document_offsets(filename), os.path.getsize(filename), chunk_bytes)
+	tasks = [(filename, start, end, specs) for start, end in ranges]
+
+	with multiprocessing.get_context("spawn").Pool(workers) as pool:
+		chunks = pool.imap(load_range, tasks) if ordered else pool.imap_unordered(load_range, tasks)
+		for docs in chunks:
+			yield from docs
+
+
+def spec(doc) -> DocumentSpec:
+	"""Rebuild the DocumentSpec a plain document was exported from"""
+	graph = doc["graph"]
+	if graph is not None:
+		if len(graph) == 1 and "id" in graph:
+			graph = GraphRef(graph["id"])
+		else:
+			state = graph
+			graph = GraphSpec.__new__(GraphSpec)
+			graph.__setstate__({
+				"id": state["id"],
+				"nodes": [NodeSpec(i) for i in state["nodes"]],
+				"edges": [EdgeSpec(i) for i in state["edges"]],
+				"lines": [LineSpec(i) for i in state["lines"]],
+			})
+
+	q = doc["question"]
+	question = QuestionSpec(q["english"], q["functional"], q["cypher"], q["type_id"], q["type_string"], q["group"])
+
+	return DocumentSpec(graph, question, doc["answer"])
+
+
+readers = {
+	"yaml": read_yaml,
+	"jsonl": read_jsonl,
+	"msgpack": read_msgpack,
+	"parquet": read_parquet,
+}
+
+def open_graph_store(filename):
+	"""The graph store (JSON Lines or binary) written alongside a dataset, or None if there isn't one"""
+	if os.path.exists(binary_store_filename(filename)):
+		return BinaryGraphStore(binary_store_filename(filename))
+	if os.path.exists(graph_store_filename(filename)):
+		return GraphStore(graph_store_filename(filename))
+	return None
+
+def resolve_graph_refs(docs, store:GraphStore):
+	"""Replace each {id: ...} graph reference with (a copy of) the graph from the store"""
+	with store:
+		for doc in docs:
+			graph = doc["graph"]
+			if graph is not None and len(graph) == 1 and "id" in graph:
+				doc["graph"] = store[graph["id"]]
+			yield doc
+
+def dataset_format(filename, format=None):
+	"""format, or else the one the file extension says, checking it is one we can read"""
+	if format is None:
+		format = os.path.splitext(filename)[1][1:]
+		if format == "yml":
+			format = "yaml"
+
+	if format not in readers:
+		raise ValueError(f"Unknown dataset format '{format}' for {filename}")
+
+	return format
+
+def read_documents(filename, format=None, resolve_graphs=True, workers=1):
+	"""
+	Yield each document of a generated dataset, inferring the format from the file extension by default.
+
+	If the dataset was written with --graph-store, graph references are resolved from the
+	store next to it unless resolve_graphs is False.
+
+	YAML is parsed in parallel if workers is more than 1, or None for one per core.
+	"""
+	format = dataset_format(filename, format)
+
+	if format == "yaml" and workers != 1:
+		docs = read_yaml_parallel(filename, workers)
+	else:
+		docs = readers[format](filename)
+
+	store = open_graph_store(filename) if resolve_graphs else None
+	if store is not None:
+		docs = resolve_graph_refs(docs, store)
+
+	return docs
+
+
+
+if __name__ == "__main__":
+
+	# Compare size and load speed of the same dataset in several formats
+	# (YAML is read in parallel, with one worker per core)
+	for filename in sys.argv[1:]:
+		start = time.perf_counter()
+		n = sum(1 for i in read_documents(filename, workers=None))
+		t = time.perf_counter() - start
+		size = os.path.getsize(filename)
+
+		print(f"{filename}: {n} docs, {size/1e6:.1f} MB, {n/t:.1f} docs/sec")
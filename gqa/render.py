@@ -0,0 +1,143 @@
+
+import multiprocessing
+from collections import deque
+
+from .types import GraphSpec
+
+import logging
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------
+# Rendering graphs to images for --draw
+#
+# Each graph is drawn once, to {prefix}-{graph id}.{format}. Drawing happens
+# in a background process pool so generation doesn't wait on matplotlib,
+# and only a plain-data summary of the graph is sent to the pool. Lines and
+# stations are drawn as collections, a handful of artists per graph
+# whatever its size
+# --------------------------------------------------------------------------
+
+FORMATS = ["png", "svg"]
+
+TAB_COLORS = ['blue', 'orange', 'green', 'red', 'purple', 'brown', 'pink', 'gray', 'olive', 'cyan']
+
+
+def drawing(graph:GraphSpec):
+	"""The parts of graph needed to draw it, as plain picklable data"""
+
+	index = {id: i for i, id in enumerate(graph.nodes)}
+	nodes = list(graph.nodes.values())
+
+	segments = []
+	colors = []
+	strokes = []
+	lines_per_station = [set() for i in nodes]
+	for e in graph.edges:
+		a, b = index[e["station1"]], index[e["station2"]]
+		segments.append(((nodes[a]["x"], nodes[a]["y"]), (nodes[b]["x"], nodes[b]["y"])))
+
+		c = e["line_color"]
+		colors.append('tab:' + c if c in TAB_COLORS else c)
+		strokes.append(e["line_stroke"])
+
+		lines_per_station[a].add(e["line_id"])
+		lines_per_station[b].add(e["line_id"])
+
+	return {
+		"id": graph.id,
+		"xs": [i["x"] for i in nodes],
+		"ys": [i["y"] for i in nodes],
+		"names": [i["name"] for i in nodes],
+		"interchange": [len(i) > 1 for i in lines_per_station],
+		"segments": segments,
+		"colors": colors,
+		"strokes": strokes,
+	}
+
+
+def render(d, filename, size=30, dpi=100, labels=True):
+	"""Draw a drawing() to filename, as PNG or SVG by its extension"""
+
+	# The object API rather than pyplot, so no figure outlives this call
+	from matplotlib.figure import Figure
+	from matplotlib.collections import LineCollection
+
+	fig = Figure(figsize=(size, size), dpi=dpi)
+	ax = fig.add_subplot()
+
+	ax.add_collection(LineCollection(d["segments"], colors=d["colors"], linestyles=d["strokes"], linewidths=4))
+
+	ax.scatter(d["xs"], d["ys"], color='black', marker='.', s=256, zorder=2)
+
+	inter_xs = [x for x, i in zip(d["xs"], d["interchange"]) if i]
+	inter_ys = [y for y, i in zip(d["ys"], d["interchange"]) if i]
+	ax.scatter(inter_xs, inter_ys, color='grey', marker='s', s=100, zorder=3)
+
+	if labels:
+		for name, x, y in zip(d["names"], d["xs"], d["ys"]):
+			ax.annotate(name, (x, y))
+
+	ax.autoscale_view()
+	fig.savefig(filename)
+
+
+class Renderer(object):
+	"""
+	Renders graphs in a pool of background processes. Each graph should be submitted
+	once (as specs() does); a graph submitted again straight away is skipped.
+
+	At most max_pending drawings wait in the pool at a time, after which submit
+	waits for the oldest, so memory stays flat however far generation runs
+	ahead. Inside a daemonic process (e.g. a --workers shard), which can't
+	start a pool of its own, graphs are drawn inline instead.
+	"""
+
+	def __init__(self, prefix, format="png", size=30, dpi=100, workers=1, labels=True, max_pending=None):
+		self.prefix = prefix
+		self.format = format
+		self.options = {"size": size, "dpi": dpi, "labels": labels}
+		self.last_id = None
+		self.pending = deque()
+		self.max_pending = max_pending if max_pending is not None else 4 * max(1, workers)
+
+		if workers > 0 and not multiprocessing.current_process().daemon:
+			self.pool = multiprocessing.get_context("spawn").Pool(workers)
+		else:
+			self.pool = None
+
+	def filename(self, graph:GraphSpec):
+		return f"{self.prefix}-{graph.id}.{self.format}"
+
+	def submit(self, graph:GraphSpec):
+		"""Draw graph, unless it is the graph submitted last"""
+		if graph.id == self.last_id:
+			return
+		self.last_id = graph.id
+
+		args = (drawing(graph), self.filename(graph))
+
+		if self.pool is None:
+			render(*args, **self.options)
+			return
+
+		while len(self.pending) >= self.max_pending:
+			self.pending.popleft().get()
+
+		self.pending.append(self.pool.apply_async(render, args, self.options))
+
+	def close(self):
+		if self.pool is not None:
+			# Raise any errors from the drawings still in flight
+			while len(self.pending) > 0:
+				self.pending.popleft().get()
+			self.pool.close()
+			self.pool.join()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		if self.pool is not None and exc[0] is not None:
+			self.pool.terminate()
+			self.pool = None
+		self.close()
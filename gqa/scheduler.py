@@ -0,0 +1,148 @@
+
+import math
+from collections import Counter
+from typing import Dict, List
+
+import logging
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------
+# Choosing which question form to try next
+# --------------------------------------------------------------------------
+
+def split_evenly(total:int, n:int, offset:int=0) -> List[int]:
+	"""Split total into n near-equal parts, the larger parts starting at position offset"""
+	return [
+		total // n + (1 if (idx - offset) % n < total % n else 0)
+		for idx in range(n)
+	]
+
+
+class AllFormsFailed(Exception):
+	"""Every question form has been abandoned, so no quota can be met"""
+	pass
+
+
+class FormScheduler(object):
+	"""
+	Picks question forms so that each type_string reaches its quota.
+
+	The form furthest from its quota (as a fraction) goes next. A form that fails is
+	retried on the same graph as often as its acceptance rate so far suggests is needed
+	for a success, up to max_retries, and a new graph is only needed once every form
+	still short of its quota has had its attempts on the current one.
+
+	Forms that have never succeeded after give_up_after attempts are abandoned and their
+	quota shared among the rest, so the run still produces the requested total.
+
+	Attempts and successes are read from f_try and f_success, so restoring those counters
+	restores the scheduler. By default choices depend only on those counts, which keeps
+	seeded runs reproducible. With use_cost, the measured cost of each form's attempts
+	against that of a new graph also decides how long a form is retried on one graph
+	(see attempts_per_graph), at the price of runs no longer reproducing exactly.
+	"""
+
+	def __init__(self, forms, quotas:Dict[str, int], f_try:Counter, f_success:Counter, max_retries=10, give_up_after=1000, use_cost=False):
+		self.forms = [i for i in forms if quotas.get(i.type_string, 0) > 0]
+		self.base_quotas = quotas
+		self.f_try = f_try
+		self.f_success = f_success
+		self.max_retries = max_retries
+		self.give_up_after = give_up_after
+		self.use_cost = use_cost
+		self.seconds = Counter()
+		self.graph_seconds = 0.0
+		self.graphs = 0
+
+		self.update_quotas()
+
+	def abandoned(self, form):
+		return self.f_try[form.type_string] >= self.give_up_after and self.f_success[form.type_string] == 0
+
+	def update_quotas(self):
+		active = [i for i in self.forms if not self.abandoned(i)]
+
+		for form in self.forms:
+			if form not in active:
+				logger.warning(f"Giving up on question form {form.type_string} after {self.f_try[form.type_string]} failures")
+
+		if len(active) == 0:
+			raise AllFormsFailed("Every question form failed to generate")
+
+		self.active = active
+		extra = sum(self.base_quotas[i.type_string] for i in self.forms if self.abandoned(i))
+		shares = split_evenly(extra, len(self.active))
+		self.quotas = {
+			form.type_string: self.base_quotas[form.type_string] + share
+			for form, share in zip(self.active, shares)
+		}
+
+	def remaining(self, form):
+		return max(0, self.quotas[form.type_string] - self.f_success[form.type_string])
+
+	@property
+	def done(self):
+		return all(self.remaining(i) == 0 for i in self.active)
+
+	def acceptance(self, form):
+		"""Estimated chance that one attempt at form succeeds"""
+		return (self.f_success[form.type_string] + 1) / (self.f_try[form.type_string] + 2)
+
+	def attempts_per_graph(self, form):
+		"""
+		Attempts that give a 95% chance of a success at the current acceptance rate.
+
+		With use_cost, a form whose attempts are cheaper than making a graph also gets
+		as many more attempts as one graph costs, since running out of attempts on
+		every form means generating another graph.
+		"""
+		p = self.acceptance(form)
+		n = math.ceil(math.log(0.05) / math.log(1 - p))
+
+		tries = self.f_try[form.type_string]
+		if self.use_cost and self.graphs > 0 and tries > 0 and self.seconds[form.type_string] > 0:
+			per_attempt = self.seconds[form.type_string] / tries
+			per_graph = self.graph_seconds / self.graphs
+			n += int(per_graph / per_attempt)
+
+		return max(1, min(self.max_retries, n))
+
+	def next_form(self, tried:Counter):
+		"""The form to try next on a graph where tried[type_string] attempts were already made, or None if a new graph is needed"""
+
+		best = None
+		best_score = 0
+
+		for form in self.active:
+			remaining = self.remaining(form)
+			if remaining > 0 and tried[form.type_string] < self.attempts_per_graph(form):
+				score = remaining / self.quotas[form.type_string]
+				if score > best_score:
+					best = form
+					best_score = score
+
+		return best
+
+	def give_up_on_graph(self, form, tried:Counter):
+		"""Make no more attempts at form on this graph"""
+		tried[form.type_string] = self.max_retries
+
+	def record_graph(self, seconds:float):
+		"""Note the time taken to make a graph"""
+		self.graph_seconds += seconds
+		self.graphs += 1
+
+	def record(self, form, seconds:float):
+		"""Note an attempt at form, after f_try and f_success have been updated"""
+		self.seconds[form.type_string] += seconds
+
+		if self.f_try[form.type_string] == self.give_up_after and self.abandoned(form):
+			self.update_quotas()
+
+	def log_stats(self):
+		for form in self.forms:
+			t = self.f_try[form.type_string]
+			if t > 0:
+				logger.debug(f"{form.type_string}: acceptance {self.f_success[form.type_string]/t:.2f}, {1000*self.seconds[form.type_string]/t:.1f}ms per attempt, {self.attempts_per_graph(form)} attempts per graph")
+		if self.graphs > 0:
+			logger.debug(f"Graphs: {1000*self.graph_seconds/self.graphs:.1f}ms each")
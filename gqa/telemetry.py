@@ -0,0 +1,182 @@
+
+import re
+import math
+import time
+from collections import Counter
+
+# --------------------------------------------------------------------------
+# Run telemetry: where generation time goes, and why questions are rejected
+#
+# Timings are kept as log-spaced histograms rather than raw samples, so memory
+# stays fixed however long the run, and shards can be merged by adding counts
+# --------------------------------------------------------------------------
+
+MIN_SECONDS = 1e-6
+BUCKETS_PER_DECADE = 10
+N_BUCKETS = 10 * BUCKETS_PER_DECADE # 1us up to ~3 hours
+
+
+class Histogram(object):
+
+	def __init__(self, counts=None, total=0.0, max=0.0):
+		self.counts = counts if counts is not None else [0] * N_BUCKETS
+		self.total = total
+		self.max = max
+
+	def add(self, seconds):
+		if seconds > MIN_SECONDS:
+			i = min(N_BUCKETS - 1, int(math.log10(seconds / MIN_SECONDS) * BUCKETS_PER_DECADE))
+		else:
+			i = 0
+		self.counts[i] += 1
+		self.total += seconds
+		if seconds > self.max:
+			self.max = seconds
+
+	def merge(self, other):
+		self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+		self.total += other.total
+		self.max = max(self.max, other.max)
+
+	@property
+	def count(self):
+		return sum(self.counts)
+
+	def percentile(self, q):
+		"""Estimated from the geometric middle of the bucket the q-th percentile falls in"""
+		target = q / 100 * self.count
+		seen = 0
+		for i, c in enumerate(self.counts):
+			seen += c
+			if seen >= target and c > 0:
+				return min(self.max, MIN_SECONDS * 10 ** ((i + 0.5) / BUCKETS_PER_DECADE))
+		return 0.0
+
+	def summary(self):
+		n = self.count
+		return {
+			"count": n,
+			"total": self.total,
+			"mean": self.total / n if n > 0 else 0.0,
+			"p50": self.percentile(50),
+			"p95": self.percentile(95),
+			"p99": self.percentile(99),
+			"max": self.max,
+		}
+
+	def __getstate__(self):
+		return {"counts": self.counts, "total": self.total, "max": self.max}
+
+
+class Timer(object):
+	def __init__(self, telemetry, phase, type_string):
+		self.telemetry = telemetry
+		self.phase = phase
+		self.type_string = type_string
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc):
+		self.telemetry.record(self.phase, time.perf_counter() - self.start, self.type_string)
+
+
+class NullTimer(object):
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		pass
+
+NULL_TIMER = NullTimer()
+
+
+def rejection_reason(ex):
+	"""Exception type and message with any numbers taken out, so alike rejections count together"""
+	return f"{type(ex).__name__}: {re.sub(r'[0-9]+', 'N', str(ex))}"
+
+
+class Telemetry(object):
+	"""
+	Per-phase timings, split by question type where there is one, and rejection counts.
+
+	Does nothing until enabled, so instrumented code costs next to nothing by default.
+	"""
+
+	def __init__(self, enabled=False):
+		self.enabled = enabled
+		self.reset()
+
+	def reset(self):
+		self.timings = {}
+		self.rejections = {}
+		self.start = time.perf_counter()
+
+	def timer(self, phase, type_string=None):
+		if not self.enabled:
+			return NULL_TIMER
+		return Timer(self, phase, type_string)
+
+	def record(self, phase, seconds, type_string=None):
+		key = (phase, type_string)
+		if key not in self.timings:
+			self.timings[key] = Histogram()
+		self.timings[key].add(seconds)
+
+	def reject(self, type_string, ex):
+		if self.enabled:
+			self.rejections.setdefault(type_string, Counter())[rejection_reason(ex)] += 1
+
+	def state(self):
+		return {
+			"timings": [[phase, type_string, h.__getstate__()] for (phase, type_string), h in self.timings.items()],
+			"rejections": {k: dict(v) for k, v in self.rejections.items()},
+		}
+
+	def merge(self, state):
+		for phase, type_string, h in state["timings"]:
+			key = (phase, type_string)
+			if key not in self.timings:
+				self.timings[key] = Histogram()
+			self.timings[key].merge(Histogram(**h))
+
+		for type_string, reasons in state["rejections"].items():
+			self.rejections.setdefault(type_string, Counter()).update(reasons)
+
+	def report(self, f_try, f_success):
+		elapsed = time.perf_counter() - self.start
+		documents = sum(f_success.values())
+
+		phases = {}
+		for (phase, type_string), h in self.timings.items():
+			if phase not in phases:
+				phases[phase] = Histogram()
+			phases[phase].merge(h)
+
+		# Rejections under None are of whole graphs rather than one form
+		forms = {}
+		for type_string in sorted(set(f_try) | {i for i in self.rejections if i is not None}):
+			forms[type_string] = {
+				"tries": f_try[type_string],
+				"successes": f_success[type_string],
+				"phases": {
+					phase: h.summary()
+					for (phase, t), h in sorted(self.timings.items())
+					if t == type_string
+				},
+				"rejections": dict(self.rejections.get(type_string, {})),
+			}
+
+		return {
+			"elapsed": elapsed,
+			"documents": documents,
+			"documents_per_second": documents / elapsed if elapsed > 0 else 0.0,
+			"phases": {phase: h.summary() for phase, h in sorted(phases.items())},
+			"forms": forms,
+			"graph_rejections": dict(self.rejections.get(None, {})),
+		}
+
+
+# The process-wide instance that generation code reports to
+telemetry = Telemetry()
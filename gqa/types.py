@@ -1,29 +1,77 @@
 
 from typing import Dict, Tuple, List, Any
 import uuid
+import random
+import numpy as np
 import networkx as nx
 
+
+def gen_id():
+	"""A uuid4 drawn from the seedable `random` module, so seeded runs reproduce their ids"""
+	return str(uuid.UUID(int=random.getrandbits(128), version=4))
+
+def gen_ids(n):
+	"""n ids, the same as n calls of gen_id would give but from one draw of random bits"""
+	data = random.getrandbits(128 * n).to_bytes(16 * n, "little") if n > 0 else b""
+
+	# Each id's bytes most significant first, as uuid.UUID(int=...) holds them
+	b = np.frombuffer(data, dtype=np.uint8).reshape(n, 16)[:, ::-1].copy()
+	b[:, 6] = b[:, 6] & 0x0f | 0x40 # Version 4
+	b[:, 8] = b[:, 8] & 0x3f | 0x80 # RFC 4122 variant
+	h = b.tobytes().hex()
+
+	return [f"{h[i:i+8]}-{h[i+8:i+12]}-{h[i+12:i+16]}-{h[i+16:i+20]}-{h[i+20:i+32]}" for i in range(0, 32 * n, 32)]
+
 # --------------------------------------------------------------------------
 # Data types for export to YAML
 # --------------------------------------------------------------------------
 
 
+# Converters to plain data, by class. stripped() finds the one for an object's
+# class or its nearest base, and remembers the answer for each class it meets
+converters = {}
+_dispatch = {}
+
+def register_converter(cls, fn):
+	converters[cls] = fn
+	_dispatch.clear()
+
+def converter_for(cls):
+	try:
+		return _dispatch[cls]
+	except KeyError:
+		fn = next((converters[c] for c in cls.__mro__ if c in converters), None)
+		_dispatch[cls] = fn
+		return fn
+
+def stripped(o):
+	"""o as plain data for export"""
+	return converter_for(type(o))(o)
+
+def stripped_value(v):
+	"""A value inside some state: converted if it can be, or if it's a sequence of things that can be"""
+	fn = converter_for(type(v))
+	if fn is not None:
+		return fn(v)
+
+	if isinstance(v, (list, tuple, set, frozenset)):
+		fns = [converter_for(type(i)) for i in v]
+		if all(fn is not None for fn in fns):
+			return [fn(i) for fn, i in zip(fns, v)]
+
+	return v
+
+
 class Strippable(object):
+	__slots__ = ()
 
 	def stripped(self):
-		state = self.__getstate__()
-		def tryStrip(i):
-			try:
-				return i.stripped()
-			except AttributeError:
-				try:
-					return [j.stripped() for j in i]
-				except Exception:
-					return i
+		return stripped(self)
 
-		return {
-			k: tryStrip(v) for k, v in state.items()
-		}
+def strip_state(o):
+	return {k: stripped_value(v) for k, v in o.__getstate__().items()}
+
+register_converter(Strippable, strip_state)
 
 
 class QuestionSpec(Strippable):
@@ -56,8 +104,8 @@ class QuestionSpec(Strippable):
 
 
 class YAMLExportDict(Strippable):
-	def __init__(self, state={}):
-		self.state = state
+	def __init__(self, state=None):
+		self.state = state if state is not None else {}
 
 	def __getitem__(self, key):
 		return self.state[key]
@@ -74,43 +122,193 @@ class YAMLExportDict(Strippable):
 	def __repr__(self):
 		return str(self.state)
 
-class NodeSpec(YAMLExportDict):
+
+UNSET = object()
+
+class Record(Strippable):
+	"""
+	A dict-like record with a fixed set of fields, held in a list rather than a dict.
+
+	Fields come out of __getstate__ in the order of the class's fields, leaving out any
+	never set, so a record exports just as the dict it replaces. Keys that aren't fields
+	(e.g. from other data sources) are kept in a dict on the side.
+	"""
+
+	__slots__ = ("values", "extra")
+	fields = ()
+	index = {}
+
+	def __init__(self, state=None):
+		self.values = [UNSET] * len(self.fields)
+		self.extra = None
+		if state is not None:
+			for k, v in state.items():
+				self[k] = v
+
+	@classmethod
+	def from_values(cls, values):
+		"""A record holding values, a list with one value (or UNSET) per field in order"""
+		r = cls.__new__(cls)
+		r.values = values
+		r.extra = None
+		return r
+
+	def __getitem__(self, key):
+		i = self.index.get(key)
+		if i is not None:
+			v = self.values[i]
+			if v is not UNSET:
+				return v
+		elif self.extra is not None and key in self.extra:
+			return self.extra[key]
+		raise KeyError(key)
+
+	def __setitem__(self, key, value):
+		i = self.index.get(key)
+		if i is not None:
+			self.values[i] = value
+		else:
+			if self.extra is None:
+				self.extra = {}
+			self.extra[key] = value
+
+	def __getstate__(self):
+		state = {k: v for k, v in zip(self.fields, self.values) if v is not UNSET}
+		if self.extra is not None:
+			state.update(self.extra)
+		return state
+
+	def __setstate__(self, state):
+		self.__init__(state)
+
+	def __repr__(self):
+		return str(self.__getstate__())
+
+
+# Record fields are plain values already
+register_converter(Record, lambda o: o.__getstate__())
+
+
+def record(cls):
+	"""Class decorator indexing a Record's fields"""
+	cls.index = {k: i for i, k in enumerate(cls.fields)}
+	return cls
+
+
+class IdRecord(Record):
+	"""A Record that is hashed and compared by its id field"""
+	__slots__ = ()
 
 	def name(self):
-		return self.state["name"]
+		return self.values[self.NAME]
 
 	def __hash__(self):
-		return hash(self.state["id"])
+		return hash(self.values[self.ID])
 
+	def __eq__(self, other):
+		return self is other or (type(other) is type(self) and self.values[self.ID] == other.values[self.ID])
 
-class EdgeSpec(YAMLExportDict):
-	pass
 
-class LineSpec(YAMLExportDict):
+@record
+class NodeSpec(IdRecord):
+	__slots__ = ()
+	fields = ("disabled_access", "has_rail", "music", "architecture", "size", "cleanliness", "id", "name", "x", "y")
+	ID = 6
+	NAME = 7
 
-	def name(self):
-		return self.state["name"]
+
+@record
+class EdgeSpec(Record):
+	__slots__ = ()
+	fields = ("station1", "station1_name", "station2", "station2_name", "line_id", "line_name", "line_color", "line_stroke")
+
+	def key(self):
+		return (self.values[0], self.values[2], self.values[4])
 
 	def __hash__(self):
-		return hash(self["id"])
+		return hash(self.key())
+
+	def __eq__(self, other):
+		return self is other or (isinstance(other, EdgeSpec) and self.key() == other.key())
+
+
+@record
+class LineSpec(IdRecord):
+	__slots__ = ()
+	fields = ("has_aircon", "color", "stroke", "built", "frequency", "depth", "id", "name")
+	ID = 6
+	NAME = 7
+
+class EdgeIndex(object):
+	"""
+	Every edge touching each node, and every edge of each line, as slices of edge
+	indices (CSR). Unlike the networkx graph, parallel edges (two lines between
+	the same stations) are all kept.
+	"""
+
+	def __init__(self, node_ids:List[str], line_ids:List[str], src, dst, line):
+		self.node_index = {id: i for i, id in enumerate(node_ids)}
+		self.line_index = {id: i for i, id in enumerate(line_ids)}
+
+		edge = np.arange(len(src))
+		self.node_indptr, self.node_edges = csr_index(len(node_ids), np.concatenate([src, dst]), np.concatenate([edge, edge]))
+		self.line_indptr, self.line_edges = csr_index(len(line_ids), line, edge)
+
+	def of_node(self, id) -> List[int]:
+		i = self.node_index[id]
+		return self.node_edges[self.node_indptr[i]:self.node_indptr[i+1]].tolist()
+
+	def of_line(self, id) -> List[int]:
+		i = self.line_index[id]
+		return self.line_edges[self.line_indptr[i]:self.line_indptr[i+1]].tolist()
+
+
+def csr_index(n, keys, values):
+	"""(indptr, values grouped by key), keeping their order within each key"""
+	order = np.argsort(keys, kind="stable")
+	indptr = np.zeros(n + 1, dtype=np.int64)
+	np.cumsum(np.bincount(keys, minlength=n), out=indptr[1:])
+	return indptr, values[order]
+
 
 class GraphSpec(Strippable):
 
-	def __init__(self, nodes:Dict[str, NodeSpec], edges:List[EdgeSpec], lines:Dict[str, LineSpec]):
-		self.id = str(uuid.uuid4())
+	def __init__(self, nodes:Dict[str, NodeSpec], edges:List[EdgeSpec], lines:Dict[str, LineSpec], id:str=None):
+		self.id = id if id is not None else gen_id()
 		self.nodes = nodes
 		self.edges = edges
 		self.lines = lines
-		self.gen_gnx()
+		self._edge_index = None
+		self._gnx = None
+
+	@property
+	def edge_index(self) -> EdgeIndex:
+		if self._edge_index is None:
+			node_index = {id: i for i, id in enumerate(self.nodes)}
+			line_index = {id: i for i, id in enumerate(self.lines)}
+			self._edge_index = EdgeIndex(
+				list(self.nodes), list(self.lines),
+				np.array([node_index[e["station1"]] for e in self.edges], dtype=np.int64),
+				np.array([node_index[e["station2"]] for e in self.edges], dtype=np.int64),
+				np.array([line_index[e["line_id"]] for e in self.edges], dtype=np.int64),
+			)
+		return self._edge_index
+
+	@property
+	def gnx(self):
+		"""The networkx graph, built the first time it's asked for"""
+		if self._gnx is None:
+			self.gen_gnx()
+		return self._gnx
 
 	def gen_gnx(self):
-		self.gnx = nx.Graph()
+		self._gnx = nx.Graph()
 		
 		for i in self.nodes.values():
-			self.gnx.add_node(i["id"], attr_dict=i)
+			self._gnx.add_node(i["id"], attr_dict=i)
 
 		for i in self.edges:
-			self.gnx.add_edge(i["station1"], i["station2"], attr_dict=i)
+			self._gnx.add_edge(i["station1"], i["station2"], attr_dict=i)
 
 	def __getstate__(self):
 		return {
@@ -126,7 +324,19 @@ class GraphSpec(Strippable):
 		# print([i.__dict__ for i in state["nodes"]])
 		self.nodes = {i["id"]:i for i in state["nodes"]}
 		self.lines = {i["id"]:i for i in state["lines"]}
-		self.gen_gnx()
+		self._edge_index = None
+		self._gnx = None
+
+
+class GraphRef(Strippable):
+	"""Stands in for a graph that is written once to a graph store (see gqa.graph_store)"""
+	def __init__(self, id:str):
+		self.id = id
+
+	def __getstate__(self):
+		return {
+			"id": self.id,
+		}
 
 
 class DocumentSpec(Strippable):
@@ -5,12 +5,12 @@ from neo4j.exceptions import CypherError
 
 from .graph_builder import GraphBuilder
 from .gql_builder import GqlBuilder
+from gqa.reader import read_documents
 from neo4j.v1 import GraphDatabase
 
 def load_qas(qa_yaml="./data/test_qs.yaml"):
-    with open(qa_yaml, "r") as file:
-        for qa in yaml.load_all(file):
-            yield qa
+    for qa in read_documents(qa_yaml):
+        yield qa
 
 
 def load_london():